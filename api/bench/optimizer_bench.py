@@ -0,0 +1,280 @@
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import CatalogSnapshot
+from optimizer import HAS_SCIPY, milp_template, scored_view, solve
+
+# =============================================================================
+# OPTIMIZER BENCHMARK
+# =============================================================================
+# the only real numbers we had were ~356 kroger rows, this builds synthetic catalogs from 1k up
+# to 1M products and times the same path a request takes: snapshot build, diet/allergy filter,
+# scoring, then the solve. results go to a json file so two runs can be diffed.
+#
+#   python bench/optimizer_bench.py --sizes 1000 10000 --out before.json
+#   python bench/optimizer_bench.py --sizes 1000 10000 --baseline before.json --out after.json
+
+# what the scrapers actually produce: (name, category, tags, protein/serving, calories/serving,
+# servings, price range, fat, carbs, fiber, share of the catalog). tags are what infer_tags in
+# kroger.py gives for these names, so the filters drop the same kind of slices they do live
+ARCHETYPES = [
+    ("Chicken Breast", "meat", ["meat", "poultry"], 26, 120, 4, (6, 12), 3, 0, 0, 8),
+    ("Ground Turkey", "meat", ["meat", "poultry"], 22, 170, 4, (5, 9), 9, 0, 0, 5),
+    ("Ground Beef 80/20", "meat", ["meat"], 19, 280, 4, (5, 10), 22, 0, 0, 6),
+    ("Pork Chops", "meat", ["meat"], 22, 190, 4, (5, 10), 10, 0, 0, 4),
+    ("Bacon", "meat", ["meat"], 6, 90, 8, (4, 8), 7, 0, 0, 3),
+    ("Frozen Chicken Nuggets", "frozen", ["meat", "poultry"], 13, 210, 6, (5, 9), 12, 13, 1, 4),
+    ("Salmon Fillet", "seafood", ["fish"], 22, 180, 3, (8, 15), 11, 0, 0, 3),
+    ("Chunk Light Tuna", "seafood", ["fish"], 20, 90, 1, (1, 2), 1, 0, 0, 5),
+    ("Shrimp", "seafood", ["fish"], 20, 90, 4, (7, 13), 1, 1, 0, 2),
+    ("Greek Yogurt", "dairy", ["dairy"], 15, 100, 4, (4, 7), 0, 6, 0, 7),
+    ("Cottage Cheese", "dairy", ["dairy"], 13, 110, 4, (3, 5), 5, 5, 0, 4),
+    ("Whole Milk", "dairy", ["dairy"], 8, 150, 8, (3, 5), 8, 12, 0, 5),
+    ("Cheddar Cheese", "dairy", ["dairy"], 7, 110, 8, (3, 6), 9, 1, 0, 4),
+    ("Soy Milk", "dairy", ["dairy", "soy"], 7, 110, 8, (3, 5), 4, 9, 1, 2),
+    ("Large Egg Dozen", "eggs", ["eggs"], 6, 70, 12, (2, 6), 5, 0, 0, 6),
+    ("Firm Tofu", "produce", ["soy"], 9, 80, 5, (2, 4), 5, 2, 1, 2),
+    ("Peanut Butter", "pantry", ["nuts"], 7, 190, 15, (2, 6), 16, 7, 2, 3),
+    ("Almonds", "snacks", ["nuts"], 6, 170, 16, (5, 9), 15, 6, 4, 2),
+    ("Black Beans", "pantry", [], 7, 110, 3, (1, 2), 0, 20, 7, 5),
+    ("Lentils", "pantry", [], 9, 120, 13, (2, 4), 0, 20, 8, 2),
+    ("Rolled Oats", "pantry", [], 5, 150, 30, (3, 6), 3, 27, 4, 3),
+    ("Whole Wheat Bread", "bread", ["gluten"], 5, 110, 20, (2, 5), 1, 20, 3, 4),
+    ("Protein Pasta", "pantry", ["gluten"], 10, 190, 8, (2, 4), 1, 35, 5, 2),
+    ("Organic Vegan Protein Powder", "supplements", ["organic", "vegan"], 20, 120, 20, (20, 40), 2, 4, 2, 2),
+    ("Keto Protein Bar with Almonds", "snacks", ["keto", "nuts"], 15, 200, 4, (6, 10), 12, 5, 9, 1),
+    ("Frozen Broccoli", "frozen", [], 3, 30, 4, (1, 3), 0, 5, 3, 3),
+]
+BRANDS = ["Kroger", "Simple Truth", "Good & Gather", "Great Value", "Private Selection", "HEB", "Market Pantry"]
+
+# (diet, allergies) like the api gets them, and the tags each one ends up excluding
+PROFILES = {
+    "none": [],
+    "vegan": ["meat", "poultry", "fish", "dairy", "eggs"],
+    "vegetarian": ["meat", "poultry", "fish"],
+    "keto": ["high_carb", "legume"],
+    "dairy+gluten+nuts": ["dairy", "gluten", "nuts"],
+}
+
+SOLVER_MAX_ROWS = {
+    "greedy": None,
+    "knapsack": None,
+    # past ~10k integer columns every solve just runs into MILP_TIME_LIMIT_SECONDS
+    "milp": 10_000,
+}
+
+
+def make_catalog(size: int, seed: int = 0, stores: int = 20) -> List[dict]:
+    rng = np.random.default_rng(seed)
+    weights = np.array([a[-1] for a in ARCHETYPES], dtype=np.float64)
+    kinds = rng.choice(len(ARCHETYPES), size=size, p=weights / weights.sum())
+    jitter = rng.lognormal(0, 0.2, size=(size, 3))
+    brands = rng.integers(len(BRANDS), size=size)
+    store_ids = rng.integers(stores, size=size)
+
+    products = []
+    for i in range(size):
+        name, category, tags, protein, calories, servings, (low, high), fat, carbs, fiber, _ = ARCHETYPES[kinds[i]]
+        price = round(low + (high - low) * float(rng.random()), 2)
+        products.append({
+            "id": f"bench-{i}",
+            "name": f"{BRANDS[brands[i]]} {name}",
+            "price": price,
+            "protein": round(protein * float(jitter[i, 0]), 1),
+            "calories": round(calories * float(jitter[i, 1]), 0),
+            "servings_per_container": max(1, round(servings * float(jitter[i, 2]))),
+            "fat": fat,
+            "carbs": carbs,
+            "fiber": fiber,
+            "category": category,
+            "tags": list(tags),
+            "store_id": f"store-{store_ids[i]}",
+            "stores": {"name": BRANDS[store_ids[i] % len(BRANDS)]},
+        })
+    return products
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def timed(fn: Callable[[], Any]) -> tuple:
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+# peak python heap for one call. tracemalloc slows everything down, so it never wraps timed runs
+def peak_memory(fn: Callable[[], Any]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_size(size: int, solvers: List[str], profiles: List[str], repeats: int, seed: int) -> Dict[str, Any]:
+    products, generate_s = timed(lambda: make_catalog(size, seed))
+    snapshot, build_s = timed(lambda: CatalogSnapshot(products, 1, "bench"))
+    result: Dict[str, Any] = {
+        "size": size,
+        "generate_s": round(generate_s, 3),
+        "snapshot_build_s": round(build_s, 3),
+        "snapshot_peak_bytes": peak_memory(lambda: CatalogSnapshot(products, 1, "bench")),
+        "profiles": {},
+    }
+
+    rng = np.random.default_rng(seed + size)
+    budgets = np.round(rng.uniform(20, 500, size=repeats), 2)
+    proteins = rng.integers(50, 400, size=repeats)
+
+    for profile in profiles:
+        view, filter_s = timed(lambda: snapshot.exclude_tags(PROFILES[profile]))
+        scored, score_s = timed(lambda: scored_view(view))
+        _, rank_s = timed(lambda: scored.order)
+        entry: Dict[str, Any] = {
+            "rows": len(view),
+            "filter_ms": round(filter_s * 1000, 3),
+            "score_ms": round(score_s * 1000, 3),
+            "rank_ms": round(rank_s * 1000, 3),
+            "solvers": {},
+        }
+
+        for solver in solvers:
+            limit = SOLVER_MAX_ROWS.get(solver)
+            if limit is not None and len(view) > limit:
+                entry["solvers"][solver] = {"skipped": f"more than {limit} rows"}
+                continue
+
+            template = milp_template(view) if solver == "milp" else None
+
+            def run(i: int) -> dict:
+                return solve(
+                    scored, float(budgets[i]), 2000, int(proteins[i]), 3,
+                    solver=solver, template=template,
+                )
+
+            run(0)  # warm up, first knapsack/milp call pays for imports and allocations
+            latencies = []
+            protein_total = 0.0
+            failures = 0
+            start = time.perf_counter()
+            for i in range(repeats):
+                solved, elapsed = timed(lambda: run(i))
+                latencies.append(elapsed)
+                if solved.get("success"):
+                    protein_total += solved["summary"]["total_protein"]
+                else:
+                    failures += 1
+            wall = time.perf_counter() - start
+
+            entry["solvers"][solver] = {
+                "repeats": repeats,
+                **percentiles(latencies),
+                "throughput_per_s": round(repeats / wall, 2),
+                "peak_bytes": peak_memory(lambda: run(0)),
+                "mean_protein": round(protein_total / max(repeats - failures, 1), 1),
+                "failures": failures,
+            }
+            print(f"  {size:>8} {profile:<18} {solver:<8} p50 {entry['solvers'][solver]['p50_ms']:>9.3f}ms"
+                  f"  p99 {entry['solvers'][solver]['p99_ms']:>9.3f}ms  {entry['solvers'][solver]['throughput_per_s']:>8.1f}/s")
+
+        result["profiles"][profile] = entry
+    return result
+
+
+# p50 change per (size, profile, solver) against an older results file
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    old = {run["size"]: run for run in baseline.get("runs", [])}
+    print("\np50 vs baseline:")
+    for run in current["runs"]:
+        before = old.get(run["size"])
+        if before is None:
+            continue
+        for profile, entry in run["profiles"].items():
+            for solver, stats in entry["solvers"].items():
+                prior = before["profiles"].get(profile, {}).get("solvers", {}).get(solver, {})
+                if "p50_ms" not in stats or "p50_ms" not in prior:
+                    continue
+                change = (stats["p50_ms"] - prior["p50_ms"]) / prior["p50_ms"] * 100 if prior["p50_ms"] else 0.0
+                print(f"  {run['size']:>8} {profile:<18} {solver:<8} {prior['p50_ms']:>9.3f} -> {stats['p50_ms']:>9.3f}ms ({change:+.1f}%)")
+
+
+def main(
+    sizes: List[int],
+    solvers: List[str],
+    profiles: List[str],
+    repeats: int,
+    seed: int,
+    out: str,
+    baseline: Optional[str] = None,
+) -> Dict[str, Any]:
+    if "milp" in solvers and not HAS_SCIPY:
+        print("scipy not installed, skipping milp")
+        solvers = [s for s in solvers if s != "milp"]
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeats": repeats,
+        "seed": seed,
+        "runs": [],
+    }
+    for size in sizes:
+        print(f"catalog of {size} products")
+        report["runs"].append(bench_size(size, solvers, profiles, repeats, seed))
+
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nwrote {out}")
+
+    if baseline:
+        with open(baseline) as f:
+            compare(report, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the basket optimizer on synthetic catalogs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--solvers", nargs="+", default=["greedy", "knapsack", "milp"], choices=["greedy", "knapsack", "milp"])
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--repeats", type=int, default=30, help="Solves per solver and profile")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json", help="Where to write the json report")
+    parser.add_argument("--baseline", help="Earlier report to compare p50s against")
+
+    args = parser.parse_args()
+
+    main(
+        sizes=args.sizes,
+        solvers=args.solvers,
+        profiles=args.profiles,
+        repeats=args.repeats,
+        seed=args.seed,
+        out=args.out,
+        baseline=args.baseline,
+    )
@@ -0,0 +1,736 @@
+import os
+import math
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import span
+
+# =============================================================================
+# PRODUCT CATALOG CACHE
+# =============================================================================
+# the catalog only changes when the scrapers run, so there's no reason to ask supabase for
+# the same 500 rows on every request. one snapshot lives in memory, a background task
+# reloads it every CATALOG_TTL_SECONDS and swaps the new one in with a single assignment.
+# everything that touches the database here is async so refreshes never block a request.
+# between reloads a change feed can hand over the rows scrapers just wrote, those are patched
+# into a new snapshot (see apply) and only the caches whose scope they touch start over.
+
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "300"))
+# with the change feed on, full reloads are only there to pick up deletes
+CATALOG_RELOAD_SECONDS = float(os.getenv("CATALOG_RELOAD_SECONDS", "3600"))
+CHANGE_FEED_INTERVAL_SECONDS = float(os.getenv("CHANGE_FEED_INTERVAL_SECONDS", "15"))
+# a delta bigger than this share of the catalog (a whole scraper run) is cheaper as a full reload
+CHANGE_FEED_MAX_FRACTION = float(os.getenv("CHANGE_FEED_MAX_FRACTION", "0.25"))
+FILTERED_VIEW_CACHE_SIZE = int(os.getenv("FILTERED_VIEW_CACHE_SIZE", "64"))
+
+
+# positions of the set bits in a python int, lowest first. goes through bytes and numpy,
+# peeling bits off one at a time copies the whole int every step and is quadratic
+def _bit_positions(bits: int) -> List[int]:
+    if not bits:
+        return []
+    raw = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder="little")).tolist()
+
+
+# the other direction, a row list -> bitset in one go instead of OR-ing rows in one by one
+def _bits_from_rows(rows: List[int], size: int) -> int:
+    flags = np.zeros(size, dtype=bool)
+    flags[rows] = True
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+
+# =============================================================================
+# INCREMENTAL UPDATES
+# =============================================================================
+# a delta only touches a few rows, so the indexes are patched instead of rebuilt. before/after
+# are row -> product (None when the row isn't live on that side), keys() says which bitsets a
+# product sits in (its tags, its category, its store)
+
+Rows = Dict[int, Optional[dict]]
+
+
+def _row_moves(before: Rows, after: Rows, keys: Callable[[dict], Iterable[str]]) -> Tuple[Dict[str, List[int]], Dict[str, List[int]]]:
+    removed: Dict[str, List[int]] = {}
+    added: Dict[str, List[int]] = {}
+    for side, moves in ((before, removed), (after, added)):
+        for row, p in side.items():
+            if p is not None:
+                for key in keys(p):
+                    moves.setdefault(key, []).append(row)
+    return removed, added
+
+
+# bitsets with some rows taken out and some put back, keys left with no rows are dropped
+def _patch_rows(rows: Dict[str, int], removed: Dict[str, List[int]], added: Dict[str, List[int]], size: int) -> Dict[str, int]:
+    patched = dict(rows)
+    for key in set(removed) | set(added):
+        bits = (patched.get(key, 0) & ~_bits_from_rows(removed.get(key, []), size)) | _bits_from_rows(added.get(key, []), size)
+        if bits:
+            patched[key] = bits
+        else:
+            patched.pop(key, None)
+    return patched
+
+
+# same rule as the catalog query (protein > 0, price > 0), a product failing it drops out of the snapshot
+def qualifies(p: dict) -> bool:
+    return (p.get("protein") or 0) > 0 and (p.get("price") or 0) > 0
+
+
+# what the catalog query ranks by (the generated protein_per_dollar column), from the row itself
+def rank_of(p: dict) -> float:
+    price = p.get("price") or 0
+    return (p.get("protein") or 0) * (p.get("servings_per_container") or 1) / price if price > 0 else 0.0
+
+
+# =============================================================================
+# TAG INDEX
+# =============================================================================
+# each tag gets a row bitset (bit i set = product i has the tag). excluding a diet + allergies
+# is then an OR over a handful of row bitsets and one AND against "all rows", no per product scans.
+
+class TagIndex:
+    def __init__(self, products: List[dict]):
+        self.tag_rows: Dict[str, int] = {}
+        self.all_rows = (1 << len(products)) - 1
+
+        positions: Dict[str, List[int]] = {}
+        for row, p in enumerate(products):
+            for tag in p.get("tags") or []:
+                positions.setdefault(tag, []).append(row)
+        for tag, rows in positions.items():
+            self.tag_rows[tag] = _bits_from_rows(rows, len(products))
+
+    def rows_with_any(self, tags: Iterable[str]) -> int:
+        rows = 0
+        for tag in tags:
+            rows |= self.tag_rows.get(tag, 0)
+        return rows
+
+    def rows_without(self, tags: Iterable[str]) -> int:
+        return self.all_rows & ~self.rows_with_any(tags)
+
+    def patched(self, before: Rows, after: Rows, size: int) -> "TagIndex":
+        index = TagIndex.__new__(TagIndex)
+        removed, added = _row_moves(before, after, lambda p: p.get("tags") or [])
+        index.tag_rows = _patch_rows(self.tag_rows, removed, added, size)
+        live = [row for row, p in after.items() if p is not None]
+        dead = [row for row, p in after.items() if p is None]
+        index.all_rows = (self.all_rows & ~_bits_from_rows(dead, size)) | _bits_from_rows(live, size)
+        return index
+
+
+# =============================================================================
+# COLUMNAR CATALOG
+# =============================================================================
+# the optimizer only ever needs a few numbers per product, so those live in numpy arrays
+# and the dicts are only touched again for the handful of items that end up in a basket
+
+def product_id(p: dict) -> str:
+    return p.get("id") or p.get("external_id") or p["name"]
+
+
+# the product fields anything built from a snapshot reads (columns, indexes, basket items).
+# the loader selects just these plus the embedded store row
+CATALOG_COLUMNS = (
+    "id", "external_id", "name", "store_id", "price",
+    "calories", "protein", "carbs", "fat", "fiber", "servings_per_container",
+    "category", "tags",
+)
+
+
+# array name, product field, value when the field is missing
+COLUMN_FIELDS = (
+    ("price", "price", 0),
+    ("protein", "protein", 0),
+    ("calories", "calories", 0),
+    ("servings", "servings_per_container", 1),
+    ("fat", "fat", 0),
+    ("carbs", "carbs", 0),
+    ("fiber", "fiber", 0),
+)
+
+
+class ProductColumns:
+    def __init__(self, products: List[dict]):
+        self.products = products
+        self.ids = [product_id(p) for p in products]
+        self.id_index: Dict[str, int] = {pid: row for row, pid in enumerate(self.ids)}
+        for name, field, default in COLUMN_FIELDS:
+            setattr(self, name, np.array([p.get(field) or default for p in products], dtype=np.float64))
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    # same columns for a subset of rows, numpy fancy indexing instead of re-reading the dicts
+    def take(self, rows: List[int]) -> "ProductColumns":
+        index = np.asarray(rows, dtype=np.intp)
+        subset = ProductColumns.__new__(ProductColumns)
+        subset.products = [self.products[i] for i in rows]
+        subset.ids = [self.ids[i] for i in rows]
+        subset.id_index = {pid: row for row, pid in enumerate(subset.ids)}
+        for name, _, _ in COLUMN_FIELDS:
+            setattr(subset, name, getattr(self, name)[index])
+        return subset
+
+    # a copy over the new product list with only the given rows re-read, new rows go on the end
+    def patched(self, products: List[dict], id_index: Dict[str, int], rows: List[int]) -> "ProductColumns":
+        columns = ProductColumns.__new__(ProductColumns)
+        columns.products = products
+        columns.ids = self.ids + [product_id(p) for p in products[len(self.ids):]]
+        columns.id_index = id_index
+        index = np.asarray(rows, dtype=np.intp)
+        grow = len(products) - len(self.products)
+        for name, field, default in COLUMN_FIELDS:
+            values = np.concatenate([getattr(self, name), np.zeros(grow)])
+            values[index] = [products[row].get(field) or default for row in rows]
+            setattr(columns, name, values)
+        return columns
+
+
+# =============================================================================
+# CATEGORY INDEX
+# =============================================================================
+# distinct categories with counts and metric ranges, built once per snapshot. rows per category
+# are bitsets like the tag index, so counting a category inside any filtered view is one AND
+# and a popcount, which is all a faceted browse needs.
+
+def _metric_range(values: np.ndarray) -> Dict[str, float]:
+    if not len(values):
+        return {"min": 0.0, "max": 0.0}
+    return {"min": round(float(values.min()), 2), "max": round(float(values.max()), 2)}
+
+
+def _category_summary(columns: "ProductColumns", index: np.ndarray) -> Dict[str, Any]:
+    price = columns.price[index]
+    protein = columns.protein[index]
+    calories = columns.calories[index]
+    total_protein = protein * columns.servings[index]
+    protein_per_dollar = np.divide(total_protein, price, out=np.zeros_like(total_protein), where=price > 0)
+    protein_per_100cal = np.divide(protein * 100, calories, out=np.zeros_like(total_protein), where=calories > 0)
+    return {
+        "count": len(index),
+        "price": _metric_range(price),
+        "protein_per_dollar": _metric_range(protein_per_dollar),
+        "protein_per_100cal": _metric_range(protein_per_100cal),
+    }
+
+
+def _category_of(p: dict) -> List[str]:
+    return [p.get("category") or "other"]
+
+
+class CategoryIndex:
+    def __init__(self, products: List[dict], columns: "ProductColumns"):
+        self.rows: Dict[str, int] = {}
+        positions: Dict[str, List[int]] = {}
+        for row, p in enumerate(products):
+            positions.setdefault(p.get("category") or "other", []).append(row)
+        for category, rows in positions.items():
+            self.rows[category] = _bits_from_rows(rows, len(products))
+
+        self.summary: Dict[str, Dict[str, Any]] = {}
+        for category in sorted(positions):
+            self.summary[category] = _category_summary(columns, np.asarray(positions[category], dtype=np.intp))
+        self.names = list(self.summary)
+
+    # only the categories a delta moved rows in or out of get their counts and ranges redone
+    def patched(self, before: Rows, after: Rows, columns: "ProductColumns", size: int) -> "CategoryIndex":
+        index = CategoryIndex.__new__(CategoryIndex)
+        removed, added = _row_moves(before, after, _category_of)
+        index.rows = _patch_rows(self.rows, removed, added, size)
+        summary = {category: facet for category, facet in self.summary.items() if category in index.rows}
+        for category in set(removed) | set(added):
+            if category in index.rows:
+                rows = np.asarray(_bit_positions(index.rows[category]), dtype=np.intp)
+                summary[category] = _category_summary(columns, rows)
+        index.summary = {category: summary[category] for category in sorted(summary)}
+        index.names = list(index.summary)
+        return index
+
+    # category -> count for the rows in row_bits (a filtered view, a store, ...)
+    def counts(self, row_bits: int) -> Dict[str, int]:
+        counts = {}
+        for category in self.names:
+            count = (self.rows[category] & row_bits).bit_count()
+            if count:
+                counts[category] = count
+        return counts
+
+
+# =============================================================================
+# STORE INDEX
+# =============================================================================
+# products carry the store they were scraped from (the catalog query embeds the stores row).
+# each store gets a row bitset, so one store's slice of any filtered view is a single AND and
+# every store can be solved on its own small partition.
+
+def haversine_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 3958.8 * 2 * math.asin(math.sqrt(a))
+
+
+def _store_info(p: dict) -> Dict[str, Any]:
+    store = p.get("stores") or {}
+    return {
+        "id": p["store_id"],
+        # the scrapers don't agree on the column, kroger/target write chain, aldi writes name
+        "name": store.get("chain") or store.get("name") or "",
+        "latitude": store.get("latitude"),
+        "longitude": store.get("longitude"),
+    }
+
+
+def _store_of(p: dict) -> List[str]:
+    return [p["store_id"]] if p.get("store_id") else []
+
+
+class StoreIndex:
+    def __init__(self, products: List[dict]):
+        self.rows: Dict[str, int] = {}
+        self.info: Dict[str, Dict[str, Any]] = {}
+        positions: Dict[str, List[int]] = {}
+        for row, p in enumerate(products):
+            store_id = p.get("store_id")
+            if not store_id:
+                continue
+            positions.setdefault(store_id, []).append(row)
+            if store_id not in self.info:
+                self.info[store_id] = _store_info(p)
+        for store_id, rows in positions.items():
+            self.rows[store_id] = _bits_from_rows(rows, len(products))
+
+    # changed products carry a fresh copy of their store row, so that info wins too
+    def patched(self, before: Rows, after: Rows, size: int) -> "StoreIndex":
+        index = StoreIndex.__new__(StoreIndex)
+        removed, added = _row_moves(before, after, _store_of)
+        index.rows = _patch_rows(self.rows, removed, added, size)
+        index.info = {store_id: info for store_id, info in self.info.items() if store_id in index.rows}
+        for p in after.values():
+            if p is not None and p.get("store_id") and (p.get("stores") or p["store_id"] not in index.info):
+                index.info[p["store_id"]] = _store_info(p)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # store ids for a chain name (what the web app sends as selected_store) and/or a radius
+    def matching(
+        self,
+        chain: Optional[str] = None,
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        radius_miles: Optional[float] = None,
+    ) -> List[str]:
+        chain = chain.strip().lower() if chain else None
+        near = latitude is not None and longitude is not None and radius_miles is not None
+
+        store_ids = []
+        for store_id, info in self.info.items():
+            if chain and chain not in info["name"].lower():
+                continue
+            if near:
+                if info["latitude"] is None or info["longitude"] is None:
+                    continue
+                if haversine_miles(latitude, longitude, info["latitude"], info["longitude"]) > radius_miles:
+                    continue
+            store_ids.append(store_id)
+        return store_ids
+
+    def distance(self, store_id: str, latitude: float, longitude: float) -> Optional[float]:
+        info = self.info[store_id]
+        if info["latitude"] is None or info["longitude"] is None:
+            return None
+        return haversine_miles(latitude, longitude, info["latitude"], info["longitude"])
+
+
+class FilteredView:
+    # a filtered slice of one snapshot, rows are positions into snapshot.products in catalog order
+    # row_bits is the same set as a bitset, for combining with the other indexes
+    def __init__(self, snapshot: "CatalogSnapshot", row_bits: int):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.row_bits = row_bits
+        self.rows = _bit_positions(row_bits)
+        self.products = [snapshot.products[i] for i in self.rows]
+        self._columns: Optional[ProductColumns] = None
+        self._derived: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # the same rows under a newer snapshot, for a view a delta didn't touch. scores, solver
+    # tables and store sub-views built on it come along, they only depend on these rows
+    def rebased(self, snapshot: "CatalogSnapshot") -> "FilteredView":
+        view = FilteredView.__new__(FilteredView)
+        view.snapshot = snapshot
+        view.version = snapshot.version
+        view.row_bits = self.row_bits
+        view.rows = self.rows
+        view.products = self.products
+        view._columns = self._columns
+        view._derived = {
+            name: value.rebased(snapshot) if isinstance(value, FilteredView) else value
+            for name, value in list(self._derived.items())
+        }
+        return view
+
+    @property
+    def columns(self) -> ProductColumns:
+        if self._columns is None:
+            self._columns = self.snapshot.columns.take(self.rows)
+        return self._columns
+
+    # per view memo for anything computed from it (scores, rankings, solver tables...)
+    # two threads racing here just compute the same thing twice, which is fine
+    def derived(self, name: str, build: Callable[["FilteredView"], Any]) -> Any:
+        value = self._derived.get(name)
+        if value is None:
+            value = build(self)
+            self._derived[name] = value
+        return value
+
+    # this view narrowed to some stores, memoized like everything else on the view
+    def for_stores(self, store_ids: Iterable[str]) -> "FilteredView":
+        store_ids = sorted(store_ids)
+
+        def build(view: "FilteredView") -> "FilteredView":
+            store_rows = 0
+            for store_id in store_ids:
+                store_rows |= view.snapshot.stores.rows.get(store_id, 0)
+            return FilteredView(view.snapshot, view.row_bits & store_rows)
+
+        return self.derived("stores:" + ",".join(store_ids), build)
+
+
+def _scopes_of(p: dict) -> List[Tuple[str, str]]:
+    return [("category", c) for c in _category_of(p)] + [("store", s) for s in _store_of(p)]
+
+
+class CatalogSnapshot:
+    # treat this as read only once it's built, a refresh makes a brand new one instead of editing this
+    def __init__(self, products: List[dict], version: int, source: str):
+        self.products = products
+        self.version = version
+        self.source = source  # "supabase" or "fallback"
+        self.loaded_at = time.time()
+        self.updated_at = self.loaded_at
+        self.tags = TagIndex(products)
+        self.columns = ProductColumns(products)
+        self.categories = CategoryIndex(products, self.columns)
+        self.stores = StoreIndex(products)
+        # version of the last full build, and ("category" | "store", name) -> version it last changed in
+        self.base_version = version
+        self.scopes: Dict[Tuple[str, str], int] = {}
+
+    def exclude_tags(self, tags: Iterable[str]) -> FilteredView:
+        return FilteredView(self, self.tags.rows_without(tags))
+
+    # age since the last full load, deltas don't reset it (only a reload notices deletes)
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    # the newest version anything in this category and/or store changed in, for etags that
+    # shouldn't move when some other part of the catalog did
+    def scope_version(self, category: Optional[str] = None, store_id: Optional[str] = None) -> int:
+        scopes = ([("category", category)] if category else []) + ([("store", store_id)] if store_id else [])
+        if not scopes:
+            return self.version
+        return max(self.scopes.get(scope, self.base_version) for scope in scopes)
+
+    # a new snapshot with some products replaced or added, every index patched for just those rows.
+    # a product that stops qualifying keeps its row position but leaves all_rows and every bitset,
+    # the next full reload compacts it away. limit is the full load's cap (top N by protein per
+    # dollar): going over it evicts the lowest ranked live rows, so a row only stays in if a reload
+    # would have loaded it too. scopes are bumped for every changed product (and what it replaced)
+    # whether or not it ends up in the catalog, the listing routes read past the cap and key their
+    # etags off them. returns the snapshot and the rows that were touched
+    def apply(self, changed: List[dict], version: int, limit: Optional[int] = None) -> Tuple["CatalogSnapshot", List[int]]:
+        products = list(self.products)
+        id_index = dict(self.columns.id_index)
+        before: Rows = {}
+        after: Rows = {}
+        scopes = dict(self.scopes)
+
+        for p in changed:
+            pid = product_id(p)
+            row = id_index.get(pid)
+            scopes.update(dict.fromkeys(_scopes_of(p), version))
+            if row is None:
+                if not qualifies(p):
+                    # never in the catalog and still isn't, only its scopes move
+                    continue
+                row = id_index[pid] = len(products)
+                products.append(p)
+            else:
+                # the old version's category/store lost it, even if it had dropped out of the catalog
+                scopes.update(dict.fromkeys(_scopes_of(products[row]), version))
+                products[row] = p
+
+            if row not in before:
+                live = row < len(self.products) and (self.tags.all_rows >> row) & 1
+                before[row] = self.products[row] if live else None
+            after[row] = p if qualifies(p) else None
+
+        if limit is not None:
+            live_rows = [row for row in _bit_positions(self.tags.all_rows) if row not in after]
+            live_rows += [row for row, p in after.items() if p is not None]
+            excess = len(live_rows) - limit
+            if excess > 0:
+                for row in sorted(live_rows, key=lambda row: rank_of(products[row]))[:excess]:
+                    if row not in before:
+                        before[row] = products[row]
+                    after[row] = None
+
+        for side in (before, after):
+            for p in side.values():
+                if p is not None:
+                    scopes.update(dict.fromkeys(_scopes_of(p), version))
+
+        rows = list(after)
+        size = len(products)
+        snapshot = CatalogSnapshot.__new__(CatalogSnapshot)
+        snapshot.products = products
+        snapshot.version = version
+        snapshot.source = self.source
+        snapshot.loaded_at = self.loaded_at
+        snapshot.updated_at = time.time()
+        snapshot.tags = self.tags.patched(before, after, size)
+        snapshot.columns = self.columns.patched(products, id_index, rows)
+        snapshot.categories = self.categories.patched(before, after, snapshot.columns, size)
+        snapshot.stores = self.stores.patched(before, after, size)
+        snapshot.base_version = self.base_version
+        snapshot.scopes = scopes
+        return snapshot, rows
+
+
+class CatalogDelta:
+    # one apply(): the snapshot before and after, and the rows it touched (positions in the new one)
+    def __init__(self, previous: CatalogSnapshot, snapshot: CatalogSnapshot, rows: List[int]):
+        self.previous = previous
+        self.snapshot = snapshot
+        self.rows = rows
+        self.row_bits = _bits_from_rows(rows, len(snapshot.products))
+
+    # could anything cached for this scope have changed? true when a touched row is visible in it
+    # before or after: not excluded by the profile's tags, and in one of the selected stores.
+    # near is (latitude, longitude, radius_miles). a catalog without store data, or a selection that
+    # matches no store, ignores the store selection, same as the routes do (store_fallback)
+    def touches(
+        self,
+        exclude_tags: Iterable[str],
+        chain: Optional[str] = None,
+        near: Optional[Tuple[float, float, float]] = None,
+    ) -> bool:
+        exclude_tags = tuple(exclude_tags)
+        for snapshot in (self.previous, self.snapshot):
+            bits = self.row_bits & snapshot.tags.rows_without(exclude_tags)
+            if bits and (chain or near) and len(snapshot.stores):
+                latitude, longitude, radius_miles = near or (None, None, None)
+                store_ids = snapshot.stores.matching(chain, latitude, longitude, radius_miles)
+                if store_ids:
+                    store_rows = 0
+                    for store_id in store_ids:
+                        store_rows |= snapshot.stores.rows[store_id]
+                    bits &= store_rows
+            if bits:
+                return True
+        return False
+
+
+class CatalogCache:
+    # loader is async and returns the product rows, or None if the database couldn't be reached
+    # fallback is only used when we have never loaded anything at all
+    def __init__(
+        self,
+        loader: Callable[[], Awaitable[Optional[List[dict]]]],
+        fallback: Callable[[], List[dict]],
+        ttl: float = CATALOG_TTL_SECONDS,
+        max_products: Optional[int] = None,
+    ):
+        self._loader = loader
+        self._fallback = fallback
+        self.ttl = ttl
+        self.max_products = max_products  # the loader's row cap, deltas keep to it too
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._refresh_lock = asyncio.Lock()  # only refreshes take this, readers never do
+        self._listeners: List[Tuple[Callable[[CatalogSnapshot], None], Optional[Callable[[CatalogDelta], None]]]] = []
+        self._views: "OrderedDict[tuple, FilteredView]" = OrderedDict()
+        self._views_lock = threading.Lock()
+        self._profile_tags: Dict[Hashable, FrozenSet[str]] = {}
+        self.deltas_applied = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    # whatever is being served right now, None before the first load
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        return self._snapshot
+
+    def is_stale(self) -> bool:
+        snapshot = self._snapshot
+        return snapshot is None or snapshot.age() >= self.ttl
+
+    # called by anything that keys off the catalog (result caches etc) so they hear about swaps.
+    # on_delta gets the swaps that came from the change feed, without it those look like any other swap
+    def add_listener(
+        self,
+        listener: Callable[[CatalogSnapshot], None],
+        on_delta: Optional[Callable[[CatalogDelta], None]] = None,
+    ) -> None:
+        self._listeners.append((listener, on_delta))
+
+    def scope_version(self, category: Optional[str] = None, store_id: Optional[str] = None) -> int:
+        snapshot = self._snapshot
+        return snapshot.scope_version(category, store_id) if snapshot is not None else self._version
+
+    async def get(self) -> CatalogSnapshot:
+        with span("catalog_fetch"):
+            snapshot = self._snapshot
+            if snapshot is None:
+                # cold start, nothing to serve yet so this one request has to wait
+                return await self.refresh()
+            return snapshot
+
+    # memoized filtered views, key is whatever identifies the filter profile (diet, allergies, ...)
+    # and the catalog version is added on top so an old view can never leak into a new catalog.
+    # diet and allergy tags are applied as two steps only so each shows up as its own stage
+    def view(
+        self,
+        snapshot: CatalogSnapshot,
+        profile: Hashable,
+        diet_tags: Iterable[str],
+        allergy_tags: Iterable[str] = (),
+    ) -> FilteredView:
+        key = (snapshot.version, profile)
+        diet_tags, allergy_tags = tuple(diet_tags), tuple(allergy_tags)
+
+        with self._views_lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+
+        with span("diet_filter"):
+            row_bits = snapshot.tags.rows_without(diet_tags)
+        # materializing the view's rows is counted with the last filter
+        with span("allergy_filter"):
+            row_bits &= snapshot.tags.rows_without(allergy_tags)
+            view = FilteredView(snapshot, row_bits)
+
+        with self._views_lock:
+            self._views[key] = view
+            self._profile_tags[profile] = frozenset(diet_tags) | frozenset(allergy_tags)
+            while len(self._views) > FILTERED_VIEW_CACHE_SIZE:
+                self._views.popitem(last=False)
+        return view
+
+    async def refresh(self) -> CatalogSnapshot:
+        async with self._refresh_lock:
+            try:
+                products = await self._loader()
+            except Exception as e:
+                print(f"Catalog refresh error: {e}")
+                products = None
+
+            if products is None:
+                if self._snapshot is not None:
+                    # keep serving the last good copy rather than dropping to fallback data
+                    return self._snapshot
+                products, source = self._fallback(), "fallback"
+            else:
+                source = "supabase"
+
+            # building the indexes is plain cpu work, keep it off the event loop
+            snapshot = await asyncio.to_thread(CatalogSnapshot, products, self._version + 1, source)
+            self._version = snapshot.version
+            self._snapshot = snapshot  # the swap, readers see either the old or the new one
+
+        with self._views_lock:
+            self._views.clear()
+
+        self._notify(snapshot)
+        return snapshot
+
+    def _notify(self, snapshot: CatalogSnapshot, delta: Optional["CatalogDelta"] = None) -> None:
+        for listener, on_delta in self._listeners:
+            try:
+                if delta is not None and on_delta is not None:
+                    on_delta(delta)
+                else:
+                    listener(snapshot)
+            except Exception as e:
+                print(f"Catalog listener error: {e}")
+
+    # changed product rows from the change feed. small deltas patch the snapshot in place of a
+    # reload, views nobody's scope touched move over to the new version, listeners get the delta.
+    # big ones (a whole scraper run) or a catalog still on fallback data just reload
+    async def apply_changes(self, changed: List[dict]) -> CatalogSnapshot:
+        if not changed:
+            return await self.get()
+
+        async with self._refresh_lock:
+            previous = self._snapshot
+            reload = (
+                previous is None
+                or previous.source != "supabase"
+                or len(changed) > CHANGE_FEED_MAX_FRACTION * max(len(previous.products), 1)
+            )
+            if not reload:
+                with span("catalog_delta"):
+                    snapshot, rows = await asyncio.to_thread(previous.apply, changed, self._version + 1, self.max_products)
+                    delta = CatalogDelta(previous, snapshot, rows)
+                self._version = snapshot.version
+                self._snapshot = snapshot
+                self.deltas_applied += 1
+
+        if reload:
+            return await self.refresh()
+
+        self._carry_views(delta)
+        self._notify(snapshot, delta)
+        return snapshot
+
+    def _carry_views(self, delta: CatalogDelta) -> None:
+        with self._views_lock:
+            carried: "OrderedDict[tuple, FilteredView]" = OrderedDict()
+            for (version, profile), view in self._views.items():
+                tags = self._profile_tags.get(profile)
+                if version == delta.previous.version and tags is not None and not delta.touches(tags):
+                    carried[(delta.snapshot.version, profile)] = view.rebased(delta.snapshot)
+            self._views = carried
+
+    # background loop started from the app lifespan
+    async def run_refresher(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Catalog refresher error: {e}")
+
+    # polls fetch_changes (async, returns the product rows changed since last time) and applies
+    # them as deltas. started from the app lifespan next to the refresher
+    async def run_change_feed(
+        self,
+        fetch_changes: Callable[[], Awaitable[Optional[List[dict]]]],
+        interval: float = CHANGE_FEED_INTERVAL_SECONDS,
+    ) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = await fetch_changes()
+                if changed:
+                    await self.apply_changes(changed)
+            except Exception as e:
+                print(f"Change feed error: {e}")
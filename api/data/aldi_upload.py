@@ -7,7 +7,7 @@ sys.path.append('../scrapers') # fix
 # my hell. 
 get_client = None  # Type hint for Pylance
 try:
-    from supabase_client import get_client
+    from supabase_client import get_client, bulk_upsert_products
     HAS_SUPABASE = True
 except ImportError:
     HAS_SUPABASE = False
@@ -123,14 +123,14 @@ def upload_products(products: List[dict], store_id: str = DEFAULT_STORE, dry_run
             print(f"   - {p['name'][:40]}... ${p['price']:.2f} | {p['protein']}g protein | {protein_per_dollar:.1f}g/$")
         return 0
     
-    # Upsert 
-    result = client.table("products").upsert(
-        to_upload,
-        on_conflict="external_id"
-    ).execute()
-    
-    count = len(result.data) if result.data else 0
-    print(f"  Uploaded {count} products")
+    # Upsert, chunked and retried by the bulk writer
+    stats = bulk_upsert_products(to_upload, on_conflict="external_id", client=client)
+    count = stats["inserted"] + stats["updated"]
+    print(f"  Uploaded {count} products ({stats['inserted']} new, {stats['updated']} updated) at {stats['rows_per_s']} rows/s")
+    if stats["failed"]:
+        print(f"  Failed: {stats['failed']}")
+        for error in stats["errors"]:
+            print(f"     - {error}")
     
     return count
 
@@ -0,0 +1,83 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from metrics import upstream
+
+# =============================================================================
+# ASYNC SUPABASE (POSTGREST) READS
+# =============================================================================
+# supabase-py's client is blocking, which ties up a threadpool worker for every query.
+# reads from the api go straight to PostgREST instead, over one pooled keep-alive
+# AsyncClient that is opened and closed with the app.
+
+SUPABASE_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "5"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+
+Params = Sequence[Tuple[str, Any]]
+
+
+class SupabaseREST:
+    def __init__(self, url: str, key: str, timeout: float = SUPABASE_TIMEOUT_SECONDS):
+        self.base_url = f"{url.rstrip('/')}/rest/v1"
+        self.key = key
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["SupabaseREST"]:
+        url = os.getenv("SUPABASE_URL")
+        key = os.getenv("SUPABASE_SERVICE_KEY")
+        if not url or not key:
+            return None
+        return cls(url, key)
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"apikey": self.key, "Authorization": f"Bearer {self.key}"},
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                keepalive_expiry=30,
+            ),
+            timeout=httpx.Timeout(self.timeout),
+        )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # one GET against a table. params are PostgREST filters as (column, "op.value") pairs,
+    # a list so the same column can show up twice (price=gt.0 and price=lt.10 etc)
+    async def select(
+        self,
+        table: str,
+        columns: str = "*",
+        params: Params = (),
+        order: Optional[str] = None,
+        limit: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        if self._client is None:
+            await self.start()
+
+        query: List[Tuple[str, Any]] = [("select", columns), *params]
+        if order:
+            query.append(("order", order))
+        if limit is not None:
+            query.append(("limit", limit))
+
+        with upstream("supabase", table):
+            response = await self._client.get(
+                f"/{table}",
+                params=query,
+                timeout=timeout if timeout is not None else self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# =============================================================================
+# IN-PROCESS LRU
+# =============================================================================
+# small thread safe LRU with hit/miss counters, shared by the api's in-memory caches.
+# values are handed out as is, so only put things in here nobody is going to mutate.
+
+class LRUCache:
+    def __init__(self, maxsize: int, name: str = "cache"):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    # move every entry to new_key(key), or drop it where that's None, in one pass under the lock
+    # so nothing set meanwhile skips the check. recency order is kept, returns how many were dropped.
+    # for caches keyed by catalog version
+    def rekey(self, new_key: Callable[[Hashable], Optional[Hashable]]) -> int:
+        with self._lock:
+            moved = [(new_key(key), value) for key, value in self._data.items()]
+            kept = OrderedDict((key, value) for key, value in moved if key is not None)
+            dropped = len(self._data) - len(kept)
+            self._data = kept
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -1,14 +1,79 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.routing import Match
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List, Literal, Tuple
+from contextlib import asynccontextmanager
 import os
+import sys
+import json
+import base64
+import time
+import math
+import hashlib
+import asyncio
+import sqlite3
+import itertools
 import httpx  # For async HTTP calls to Spoonacular
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # so the sibling modules import from anywhere
+
+from catalog import (
+    CATALOG_COLUMNS, CATALOG_RELOAD_SECONDS, CATALOG_TTL_SECONDS, CHANGE_FEED_INTERVAL_SECONDS,
+    CatalogCache, CatalogDelta, CatalogSnapshot, FilteredView,
+)
+from db import SupabaseREST
+from lru import LRUCache
+from mirror import MIRROR_PATH, CatalogMirror, fetch_products_since, overlap_since
+import metrics
+from metrics import span, upstream
+from recipes import RecipeCache
+from optimizer import optimize_view, pareto_frontier, repair_basket, scored_view, solve_batch, shutdown_pool
+
 load_dotenv()
 
 SPOONACULAR_API_KEY = os.getenv("SPOONACULAR_API_KEY")
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+FRONTIER_MAX_BUDGET = float(os.getenv("FRONTIER_MAX_BUDGET", "500"))
+CATALOG_CACHE_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", "60"))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+SPOONACULAR_BASE = "https://api.spoonacular.com"
+SPOONACULAR_TIMEOUT_SECONDS = float(os.getenv("SPOONACULAR_TIMEOUT_SECONDS", "10"))
+SPOONACULAR_MAX_CONNECTIONS = int(os.getenv("SPOONACULAR_MAX_CONNECTIONS", "20"))
+
+# orjson is a lot faster than stdlib json on big lists of dicts. routes that return one of these
+# directly also skip fastapi's jsonable_encoder walk entirely
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with span("serialization"):
+            if HAS_ORJSON:
+                return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+            return super().render(content)
+
+# brotli when brotli-asgi is installed (it still gzips for clients that don't speak br), gzip otherwise
+try:
+    from brotli_asgi import BrotliMiddleware
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+# http2 needs the h2 package (httpx[http2]), plain keep-alive http/1.1 otherwise
+try:
+    import h2  # noqa: F401
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
 
 if not SPOONACULAR_API_KEY:
     try:
@@ -17,24 +82,66 @@ if not SPOONACULAR_API_KEY:
     except ImportError:
         SPOONACULAR_API_KEY = None
 
-# really big lines that say, connect. 
-try:
-    from supabase import create_client, Client
-    SUPABASE_URL = os.getenv("SUPABASE_URL")
-    SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-    
-    if SUPABASE_URL and SUPABASE_KEY:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        HAS_SUPABASE = True
-        print(" Connected to Supabase")
-    else:
-        HAS_SUPABASE = False
-        print(" Supabase credentials not found smart guy")
-except ImportError:
-    HAS_SUPABASE = False
-    print(" You aren't the brightest huh. ")
+# really big lines that say, connect. reads go through the async PostgREST client in db.py
+db = SupabaseREST.from_env()
+HAS_SUPABASE = db is not None
 
-app = FastAPI(title="Cuenta API", version="2.0")
+if HAS_SUPABASE:
+    print(" Supabase configured")
+else:
+    print(" Supabase credentials not found smart guy")
+
+# local sqlite copy of products + stores that the catalog and /api/products read from, see mirror.py.
+# MIRROR_PATH= (empty) turns it off and everything reads supabase directly like before
+mirror: Optional[CatalogMirror] = None
+if HAS_SUPABASE and MIRROR_PATH:
+    try:
+        mirror = CatalogMirror()
+    except (OSError, sqlite3.Error) as e:
+        print(f" Catalog mirror unavailable, reading Supabase directly: {e}")
+
+# one long lived client for every spoonacular call, opened and closed by the lifespan
+spoonacular: Optional[httpx.AsyncClient] = None
+recipe_cache = RecipeCache()
+
+
+def create_spoonacular_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=SPOONACULAR_BASE,
+        http2=HAS_HTTP2,
+        limits=httpx.Limits(
+            max_connections=SPOONACULAR_MAX_CONNECTIONS,
+            max_keepalive_connections=SPOONACULAR_MAX_CONNECTIONS // 2,
+            keepalive_expiry=60,
+        ),
+        timeout=httpx.Timeout(SPOONACULAR_TIMEOUT_SECONDS, connect=5.0),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # open the connection pools, warm the catalog before taking traffic, then keep it fresh in the background
+    global spoonacular
+    spoonacular = create_spoonacular_client()
+    if db is not None:
+        await db.start()
+    await catalog.refresh()
+    tasks = [asyncio.create_task(catalog.run_refresher())]
+    if CHANGE_FEED:
+        tasks.append(asyncio.create_task(catalog.run_change_feed(load_product_changes)))
+    yield
+    for task in tasks:
+        task.cancel()
+    shutdown_pool()
+    await spoonacular.aclose()
+    spoonacular = None
+    if db is not None:
+        await db.close()
+    if mirror is not None:
+        mirror.close()
+
+
+app = FastAPI(title="Cuenta API", version="2.0", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -45,11 +152,52 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+
+# big catalog json compresses really well, tiny responses aren't worth the cpu
+if HAS_BROTLI:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+
+# route template for the metric labels, raw paths would let any 404 scan mint new series
+def route_label(scope) -> str:
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+# outermost middleware, so the timing includes compression. stages recorded by span() during
+# the request come back as a Server-Timing header for the browser devtools
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    route = route_label(request.scope)
+    stages = metrics.start_request(route)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        metrics.http_seconds.observe(time.perf_counter() - start, method=request.method, route=route)
+        metrics.http_requests.inc(method=request.method, route=route, status=str(status))
+    if stages:
+        response.headers["Server-Timing"] = metrics.server_timing(stages)
+    return response
+
+
 # safely extracts integer value from LP variable, let it be known sonarqube I HATE YOU. 
 # =============================================================================
 # MODELS
 # =============================================================================
 
+class MacroBounds(BaseModel):
+    min: Optional[float] = Field(default=None, ge=0)
+    max: Optional[float] = Field(default=None, ge=0)
+
+
 class OptimizeRequest(BaseModel):
     budget: float = Field(default=75.0, ge=20, le=500)
     daily_calories: int = Field(default=2000, ge=1200, le=5000)
@@ -59,6 +207,55 @@ class OptimizeRequest(BaseModel):
     allergies: List[str] = Field(default=[], description="List of allergies to exclude")
     university_name: Optional[str] = Field(default=None)  
     selected_store: Optional[str] = Field(default=None)  
+    solver: Literal["greedy", "knapsack", "milp"] = Field(default="greedy", description="greedy (fast, default), knapsack (exact max protein for the budget) or milp (max protein with macro targets)")
+    budget_resolution_cents: Optional[int] = Field(default=None, ge=1, le=100, description="Knapsack price granularity, coarser is faster")
+    macros: Dict[Literal["protein", "calories", "fat", "carbs", "fiber"], MacroBounds] = Field(
+        default={}, description="Weekly min/max totals (grams, calories for calories), milp solver only"
+    )
+
+    def macro_targets(self) -> dict:
+        return {name: bounds.model_dump() for name, bounds in self.macros.items()}
+
+
+# per store baskets for every store in scope (selected_store chain and/or a radius around the user).
+# split lets one basket span stores, each store past the first costs store_penalty off the budget
+class StoreOptimizeRequest(OptimizeRequest):
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
+    radius_miles: float = Field(default=10.0, gt=0, le=100)
+    split: bool = Field(default=False, description="Also look for a basket spread over a few stores")
+    store_penalty: float = Field(default=5.0, ge=0, le=100, description="Dollars per extra store in split mode")
+    max_split_stores: int = Field(default=3, ge=2, le=4)
+
+
+class BatchOptimizeRequest(BaseModel):
+    requests: List[OptimizeRequest] = Field(..., min_length=1, max_length=1000)
+
+
+class BasketEntry(BaseModel):
+    id: str
+    quantity: int = Field(..., ge=1)
+
+
+# the basket the user has now plus the new settings. exclude_ids is every product they've
+# removed so far, not just the latest one, so a removed item can't be added back by the refill
+class RepairRequest(BaseModel):
+    items: List[BasketEntry] = Field(..., max_length=500)
+    budget: float = Field(default=75.0, ge=20, le=500)
+    daily_calories: int = Field(default=2000, ge=1200, le=5000)
+    daily_protein: int = Field(default=150, ge=50, le=400)
+    max_per_product: int = Field(default=3, ge=1, le=10)
+    diet: Optional[str] = Field(default=None)
+    allergies: List[str] = Field(default=[])
+    selected_store: Optional[str] = Field(default=None)
+    exclude_ids: List[str] = Field(default=[], max_length=500)
+
+
+class FrontierRequest(BaseModel):
+    budget: float = Field(default=FRONTIER_MAX_BUDGET, ge=1, le=FRONTIER_MAX_BUDGET, description="Only return baskets up to this cost")
+    max_per_product: int = Field(default=3, ge=1, le=10)
+    diet: Optional[str] = Field(default=None)
+    allergies: List[str] = Field(default=[])
 
 
 class BasketItem(BaseModel):
@@ -95,51 +292,158 @@ ALLERGY_TAG_MAP = {
 }
 
 
-def get_products_from_supabase(
-    diet: Optional[str] = None,
-    allergies: Optional[List[str]] = None,
-    store_chain: Optional[str] = None,
-) -> List[dict]:    
-    if not HAS_SUPABASE or supabase is None:
-        return get_fallback_products()
-    
+CATALOG_MAX_PRODUCTS = 500
+
+
+# catches the mirror up and reads the catalog out of it
+async def load_products_from_mirror() -> Optional[List[dict]]:
+    try:
+        changed = await mirror.sync(db)
+        if changed:
+            print(f"✓ Mirror synced {len(changed)} changed products")
+    except Exception as e:
+        print(f"Mirror sync error: {e}")
+
+    # a failed sync is fine while the copy is recent, past MIRROR_MAX_STALENESS_SECONDS go direct
+    if not mirror.is_fresh():
+        return None
+    try:
+        products = await run_in_threadpool(mirror.catalog, CATALOG_COLUMNS, CATALOG_MAX_PRODUCTS)
+    except sqlite3.Error as e:
+        print(f"Mirror read error: {e}")
+        return None
+    if products:
+        print(f"✓ Loaded {len(products)} products from the mirror")
+    return products or None
+
+
+# only the catalog refresher calls this. mirror first, the actual round trip if that has nothing
+# None means "nothing usable", the cache then keeps its last copy or drops to the fallback list
+async def load_products_from_supabase() -> Optional[List[dict]]:
+    if not HAS_SUPABASE or db is None:
+        return None
+
+    if mirror is not None:
+        products = await load_products_from_mirror()
+        if products:
+            return products
+
+    # the change feed starts from here, taken before the catalog query so nothing written in
+    # between is missed (the mirror keeps its own watermark)
+    if CHANGE_FEED and mirror is None:
+        await seed_change_watermark()
+
     try:
         # Base query - only products with nutrition data
-        query = supabase.table("products").select("*").gt("protein", 0).gt("price", 0)
-        result = query.order("protein_per_dollar", desc=True).limit(500).execute()
-        
-        if not result.data:
+        # only the columns the catalog reads, stores(*) embeds the store row so the catalog can be
+        # partitioned per store (chain only exists on scraper created stores, so no list there)
+        products = await db.select(
+            "products",
+            columns=",".join(CATALOG_COLUMNS) + ",stores(*)",
+            params=[("protein", "gt.0"), ("price", "gt.0")],
+            order="protein_per_dollar.desc",
+            limit=CATALOG_MAX_PRODUCTS,
+        )
+
+        if not products:
             print("No products found in Supabase")
-            return get_fallback_products()
-        
-        products = result.data
+            return None
+
         print(f"✓ Loaded {len(products)} products from Supabase")
-        
-        # Apply diet filter
-        if diet and diet in DIET_EXCLUDE_TAGS:
-            exclude_tags = DIET_EXCLUDE_TAGS[diet]
-            products = [
-                p for p in products
-                if not any(tag in (p.get("tags") or []) for tag in exclude_tags)
-            ]
-            print(f"  After {diet} filter: {len(products)} products")
-        
-        # Apply allergy filters
-        if allergies:
-            for allergy in allergies:
-                if allergy in ALLERGY_TAG_MAP:
-                    exclude_tags = ALLERGY_TAG_MAP[allergy]
-                    products = [
-                        p for p in products
-                        if not any(tag in (p.get("tags") or []) for tag in exclude_tags)
-                    ]
-            print(f"  After allergy filters: {len(products)} products")
-        
         return products
-        
+
     except Exception as e:
         print(f"Supabase error: {e}")
-        return get_fallback_products()
+        return None
+
+
+# =============================================================================
+# CHANGE FEED
+# =============================================================================
+# scrapers upsert with a fresh last_updated (the product_updated trigger), so polling for rows past
+# a watermark is enough to hear about every write. with the mirror that's its incremental sync,
+# without it the same keyset query straight against supabase. supabase realtime would need a
+# websocket client the api doesn't have, polling every CHANGE_FEED_INTERVAL_SECONDS is plenty for
+# a catalog that changes a few times a day. deletes still wait for the (now hourly) full reload.
+
+CHANGE_FEED = HAS_SUPABASE and CHANGE_FEED_INTERVAL_SECONDS > 0
+change_watermark: Optional[str] = None
+# product id -> last_updated already handed over from inside the overlap window, so re-reads
+# of the same rows don't turn into deltas every poll
+change_seen: Dict[str, str] = {}
+
+
+async def seed_change_watermark() -> None:
+    global change_watermark
+    try:
+        latest = await db.select("products", columns="last_updated", order="last_updated.desc.nullslast", limit=1)
+        if not latest or not latest[0].get("last_updated"):
+            return
+        # the overlap window is already in the load that follows, first poll shouldn't replay it
+        window = await fetch_products_since(db, overlap_since(latest[0]["last_updated"]), columns="id,last_updated")
+    except Exception as e:
+        print(f"Change feed watermark error: {e}")
+        return
+    change_watermark = latest[0]["last_updated"]
+    change_seen.clear()
+    change_seen.update((p["id"], p["last_updated"]) for p in window)
+
+
+async def load_product_changes() -> Optional[List[dict]]:
+    global change_watermark, change_seen
+    if db is None:
+        return None
+
+    if mirror is not None:
+        changed = await mirror.sync(db)
+        if not changed:
+            return []
+        return await run_in_threadpool(mirror.catalog_rows, [p["id"] for p in changed], CATALOG_COLUMNS)
+
+    if change_watermark is None:
+        # only when seeding at load failed, starts from here
+        await seed_change_watermark()
+        return []
+
+    # same overlap as the mirror: writes run as several concurrent transactions, one can commit
+    # after a newer one with an earlier last_updated. apply() replaces by id, re-reading is safe
+    rows = await fetch_products_since(
+        db,
+        overlap_since(change_watermark),
+        columns=",".join(CATALOG_COLUMNS) + ",last_updated,stores(*)",
+    )
+    changed = [p for p in rows if change_seen.get(p["id"]) != p.get("last_updated")]
+    change_seen = {p["id"]: p.get("last_updated") for p in rows}
+    if rows:
+        change_watermark = rows[-1]["last_updated"] or change_watermark
+    return changed
+
+
+# diet + allergies -> the set of tags to drop, unknown names are ignored like before
+def normalize_filters(diet: Optional[str], allergies: Optional[List[str]]) -> tuple:
+    diet_key = diet if diet in DIET_EXCLUDE_TAGS else None
+    allergy_key = tuple(sorted(set(a for a in (allergies or []) if a in ALLERGY_TAG_MAP)))
+    return diet_key, allergy_key
+
+
+async def get_filtered_view(
+    diet: Optional[str] = None,
+    allergies: Optional[List[str]] = None,
+    snapshot: Optional[CatalogSnapshot] = None,
+) -> FilteredView:
+    snapshot = snapshot or await catalog.get()
+    diet_key, allergy_key = normalize_filters(diet, allergies)
+    diet_tags, allergy_tags = profile_tags(diet_key, allergy_key)
+    return catalog.view(snapshot, (diet_key, allergy_key), diet_tags, allergy_tags)
+
+
+# normalized diet + allergies -> (diet tags, allergy tags) they exclude
+def profile_tags(diet_key: Optional[str], allergy_key: tuple) -> tuple:
+    allergy_tags = set()
+    for allergy in allergy_key:
+        allergy_tags.update(ALLERGY_TAG_MAP[allergy])
+    return DIET_EXCLUDE_TAGS.get(diet_key, []), allergy_tags
+
 
 # most common things i've seen that need a fallback
 def get_fallback_products() -> List[dict]:
@@ -175,115 +479,80 @@ def get_fallback_products() -> List[dict]:
             "tags": ["eggs"],
         },
     ]
-    
-# =============================================================================
-# OPTIMIZATION LOGIC
-# =============================================================================
 
-def optimize_basket(
-    products: List[dict],
-    budget: float,
-    daily_calories: int,
-    daily_protein: int,
-    max_per_product: int = 3,
-) -> dict:
-    
-    weekly_protein_target = daily_protein * 7
-    weekly_calorie_target = daily_calories * 7
-    
-    # Score products by protein efficiency
-    scored_products = []
-    for p in products:
-        price = p.get("price", 0)
-        protein_per_serving = p.get("protein", 0)
-        calories_per_serving = p.get("calories", 0)
-        servings = p.get("servings_per_container", 1) or 1
-        
-        if price <= 0 or protein_per_serving <= 0:
-            continue
-        
-        total_protein = protein_per_serving * servings
-        total_calories = calories_per_serving * servings
-        protein_per_dollar = total_protein / price
-        
-        scored_products.append({
-            **p,
-            "total_protein": total_protein,
-            "total_calories": total_calories,
-            "protein_per_dollar": protein_per_dollar,
-            "score": protein_per_dollar,  
-        })
-    
-    # neat  and sorts by protein efficiency
-    scored_products.sort(key=lambda x: x["score"], reverse=True)
-# greed is a sin     
-    basket = []
-    total_cost = 0
-    total_protein = 0
-    total_calories = 0
-    selected_ids = {}
-    
-    for product in scored_products:
-        product_id = product.get("id") or product.get("external_id") or product["name"]
-        price = product["price"]
-        
-        # Check constraints
-        if selected_ids.get(product_id, 0) >= max_per_product:
-            continue
-        
-        if total_cost + price > budget:
-            continue
-        
-        # Add to basket
-        qty = selected_ids.get(product_id, 0) + 1
-        selected_ids[product_id] = qty
-        
-        total_cost += price
-        total_protein += product["total_protein"]
-        total_calories += product["total_calories"]
-        
-        # Check if already in basket
-        existing = next((item for item in basket if item["id"] == product_id), None)
-        if existing:
-            existing["quantity"] += 1
-            existing["total_price"] = existing["quantity"] * existing["unit_price"]
-            existing["total_protein"] = existing["quantity"] * product["total_protein"]
-            existing["total_calories"] = existing["quantity"] * product["total_calories"]
-        else:
-            basket.append({
-                "id": product_id,
-                "name": product["name"],
-                "quantity": 1,
-                "unit_price": price,
-                "total_price": price,
-                "total_protein": product["total_protein"],
-                "total_calories": product["total_calories"],
-                "fitness_score": product["score"],
-                "reason": f"{product['score']:.1f}g protein per dollar",
-                "category": product.get("category", "other"),
-            })
-        
-        # Stop if we've hit targets and therefore don't need more
-        if total_protein >= weekly_protein_target and total_calories >= weekly_calorie_target * 0.8:
-            break
-    # good to calculate budget util
-    budget_util = (total_cost / budget * 100) if budget > 0 else 0
-    calorie_achievement = (total_calories / weekly_calorie_target * 100) if weekly_calorie_target > 0 else 0
-    
-    return {
-        "success": True,
-        "status": "optimized",
-        "summary": {
-            "total_cost": round(total_cost, 2),
-            "total_protein": round(total_protein, 1),
-            "total_calories": round(total_calories, 0),
-            "budget": budget,
-            "calorie_target": weekly_calorie_target,
-            "budget_utilization": f"{budget_util:.1f}%",
-            "calorie_achievement": f"{calorie_achievement:.1f}%",
-        },
-        "items": basket,
-    }
+
+# one process wide copy of the catalog, see catalog.py. with the change feed keeping it current
+# the full reload is only there for deletes, so it runs far less often
+catalog = CatalogCache(
+    loader=load_products_from_supabase,
+    fallback=get_fallback_products,
+    ttl=CATALOG_RELOAD_SECONDS if CHANGE_FEED else CATALOG_TTL_SECONDS,
+    max_products=CATALOG_MAX_PRODUCTS,
+)
+
+
+# on a catalog delta, entries whose scope (filter profile, store selection) saw a changed product
+# are dropped and everything else moves to the new version as is. scope(key) gives
+# (diet, allergies, chain, near) for an entry, lots of entries share one so each is checked once
+def carry_over(cache: LRUCache, scope: Callable[[tuple], tuple]) -> Callable[[CatalogDelta], None]:
+    def on_delta(delta: CatalogDelta) -> None:
+        touched: Dict[tuple, bool] = {}
+
+        def new_key(key: tuple) -> Optional[tuple]:
+            if key[0] != delta.previous.version:
+                return None
+            entry_scope = scope(key)
+            if entry_scope not in touched:
+                diet, allergies, chain, near = entry_scope
+                diet_tags, allergy_tags = profile_tags(diet, allergies)
+                touched[entry_scope] = delta.touches(set(diet_tags) | allergy_tags, chain=chain, near=near)
+            return None if touched[entry_scope] else (delta.snapshot.version,) + key[1:]
+
+        dropped = cache.rekey(new_key)
+        metrics.cache_invalidations.inc(dropped, cache=cache.name, outcome="dropped")
+        metrics.cache_invalidations.inc(len(cache), cache=cache.name, outcome="kept")
+
+    return on_delta
+
+
+# result keys are result_cache_key() plus, for /api/optimize/stores, ("stores", (lat, lon, radius) | None, ...).
+# the stored coordinates are rounded to 3 places (~0.07 mi), so the radius gets that much slack
+def result_scope(key: tuple) -> tuple:
+    near = key[12] if len(key) > 12 and key[11] == "stores" else None
+    if near is not None:
+        near = (near[0], near[1], near[2] + 0.1)
+    return key[1], key[2], key[10], near
+
+
+# most traffic is the same few presets, so finished baskets are kept per normalized request
+# + catalog version. a reload clears it, a delta only drops the baskets it could have changed
+result_cache = LRUCache(RESULT_CACHE_SIZE, name="optimize_results")
+catalog.add_listener(lambda snapshot: result_cache.clear(), on_delta=carry_over(result_cache, result_scope))
+
+# one frontier per (catalog version, filter profile, max_per_product), always computed up to
+# FRONTIER_MAX_BUDGET so any smaller budget is just a slice of the cached one
+frontier_cache = LRUCache(64, name="frontier")
+catalog.add_listener(
+    lambda snapshot: frontier_cache.clear(),
+    on_delta=carry_over(frontier_cache, lambda key: (key[1], key[2], None, None)),
+)
+
+
+def result_cache_key(request: "OptimizeRequest", version: int) -> tuple:
+    diet, allergies = normalize_filters(request.diet, request.allergies)
+    return (
+        version,
+        diet,
+        allergies,
+        round(request.budget, 2),
+        request.daily_calories,
+        request.daily_protein,
+        request.max_per_product,
+        request.solver,
+        request.budget_resolution_cents,
+        tuple(sorted((name, bounds.min, bounds.max) for name, bounds in request.macros.items())),
+        request.selected_store,
+    )
 
 # =============================================================================
 # API ROUTES
@@ -301,59 +570,672 @@ def root():
 
 
 @app.get("/api/health")
-def health():
-    return {"status": "ok", "database": "connected" if HAS_SUPABASE else "fallback"}
+async def health():
+    snapshot = await catalog.get()
+    return {
+        "status": "ok",
+        "database": "connected" if HAS_SUPABASE else "fallback",
+        "catalog": {
+            "version": snapshot.version,
+            "source": snapshot.source,
+            "products": len(snapshot.products),
+            "age_seconds": round(snapshot.age(), 1),
+            "deltas_applied": catalog.deltas_applied,
+            "change_feed": CHANGE_FEED,
+        },
+        "mirror": await run_in_threadpool(mirror.stats) if mirror is not None else None,
+    }
 
 
-@app.get("/api/products")
-def get_products(
-    category: Optional[str] = None,
-    limit: int = 50,
-):
-    products = get_products_from_supabase()
-    
-    if category and category != "all":
-        products = [p for p in products if p.get("category") == category]
-    
+# =============================================================================
+# HTTP CACHING
+# =============================================================================
+# catalog responses only change when the catalog version does, so the etag is the version plus
+# the query string. it's weak: the compression middleware sends identity, gzip and br bodies
+# under the same tag, equivalent but not byte identical. a client that already has it gets a 304
+# before we touch the database.
+
+def catalog_etag(request: Request, version: int) -> str:
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    digest = hashlib.md5(f"{request.url.path}?{query}".encode()).hexdigest()[:16]
+    return f'W/"v{version}-{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def catalog_headers(etag: str) -> dict:
     return {
-        "success": True,
-        "count": len(products[:limit]),
-        "products": products[:limit],
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CATALOG_CACHE_MAX_AGE}, stale-while-revalidate={CATALOG_CACHE_MAX_AGE * 5}",
     }
 
 
-@app.post("/api/optimize")
-def optimize(request: OptimizeRequest):
-    products = get_products_from_supabase(
-        diet=request.diet,
-        allergies=request.allergies,
-        store_chain=request.selected_store,
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=catalog_headers(etag))
+
+
+# =============================================================================
+# PRODUCT LISTING
+# =============================================================================
+# keyset pagination on (protein_per_dollar, id), the last row of a page comes back as an opaque cursor.
+# filters go into the query itself so only the page we need ever leaves the database.
+
+PRODUCTS_PAGE_MAX = 200
+
+
+def encode_cursor(product: dict) -> str:
+    raw = json.dumps([product.get("protein_per_dollar") or 0, str(product["id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+# the cursor comes from the client, so only a finite number and a plain string id get through
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        ppd, pid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        ppd = float(ppd)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(pid, str) or not math.isfinite(ppd):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return ppd, pid
+
+
+# a value inside a postgrest or=(...) tree, double quoted so commas, parens and dots in it
+# can't end the condition early or add new ones
+def postgrest_quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def product_filters(
+    category: Optional[str],
+    store_id: Optional[str],
+    min_protein_per_dollar: Optional[float],
+    min_protein_per_100cal: Optional[float],
+    max_price: Optional[float],
+    after: Optional[tuple],
+) -> List[tuple]:
+    params = [("protein", "gt.0"), ("price", "gt.0")]
+    if category and category != "all":
+        params.append(("category", f"eq.{category}"))
+    if store_id:
+        params.append(("store_id", f"eq.{store_id}"))
+    if min_protein_per_dollar is not None:
+        params.append(("protein_per_dollar", f"gte.{min_protein_per_dollar}"))
+    if min_protein_per_100cal is not None:
+        params.append(("protein_per_100cal", f"gte.{min_protein_per_100cal}"))
+    if max_price is not None:
+        params.append(("price", f"lte.{max_price}"))
+    if after is not None:
+        ppd, pid = after
+        params.append(("or", f"(protein_per_dollar.lt.{ppd},and(protein_per_dollar.eq.{ppd},id.lt.{postgrest_quote(pid)}))"))
+    return params
+
+
+# no database (or it's down) means paging the in-memory catalog the same way
+def paginate_catalog(
+    products: List[dict],
+    category: Optional[str],
+    store_id: Optional[str],
+    min_protein_per_dollar: Optional[float],
+    min_protein_per_100cal: Optional[float],
+    max_price: Optional[float],
+    after: Optional[tuple],
+    limit: int,
+) -> List[dict]:
+    def ppd(p: dict) -> float:
+        if p.get("protein_per_dollar") is not None:
+            return p["protein_per_dollar"]
+        price = p.get("price") or 0
+        return (p.get("protein") or 0) * (p.get("servings_per_container") or 1) / price if price > 0 else 0
+
+    def per_100cal(p: dict) -> float:
+        if p.get("protein_per_100cal") is not None:
+            return p["protein_per_100cal"]
+        calories = p.get("calories") or 0
+        return (p.get("protein") or 0) / calories * 100 if calories > 0 else 0
+
+    rows = []
+    for p in products:
+        key = (ppd(p), str(p["id"]))
+        if category and category != "all" and p.get("category") != category:
+            continue
+        if store_id and p.get("store_id") != store_id:
+            continue
+        if min_protein_per_dollar is not None and key[0] < min_protein_per_dollar:
+            continue
+        if min_protein_per_100cal is not None and per_100cal(p) < min_protein_per_100cal:
+            continue
+        if max_price is not None and (p.get("price") or 0) > max_price:
+            continue
+        if after is not None and key >= after:
+            continue
+        rows.append((key, p))
+
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return [{**p, "protein_per_dollar": key[0]} for key, p in rows[:limit]]
+
+
+async def fetch_products_page(filters: tuple, after: Optional[tuple], limit: int) -> List[dict]:
+    # an indexed sqlite page, no network. the refresher keeps it synced. off the loop, the read
+    # lock can be held by a catalog reload or a sync
+    if mirror is not None and mirror.is_fresh():
+        try:
+            with span("mirror_read"):
+                return await run_in_threadpool(mirror.page, *filters, after, limit)
+        except sqlite3.Error as e:
+            print(f"Mirror read error: {e}")
+
+    if db is not None:
+        try:
+            return await db.select(
+                "products",
+                params=product_filters(*filters, after),
+                order="protein_per_dollar.desc,id.desc",
+                limit=limit,
+            )
+        except Exception as e:
+            print(f"Supabase error: {e}")
+
+    snapshot = await catalog.get()
+    return paginate_catalog(snapshot.products, *filters, after, limit)
+
+
+def dump_line(product: dict) -> bytes:
+    if HAS_ORJSON:
+        return orjson.dumps(product) + b"\n"
+    return (json.dumps(product) + "\n").encode()
+
+
+# ndjson mode, one product per line, pulled from the database a page at a time so
+# nothing here holds more than one page no matter how big the catalog gets
+async def stream_products(filters: tuple, after: Optional[tuple]):
+    while True:
+        page = await fetch_products_page(filters, after, PRODUCTS_PAGE_MAX)
+        for product in page:
+            yield dump_line(product)
+        if len(page) < PRODUCTS_PAGE_MAX:
+            return
+        after = decode_cursor(encode_cursor(page[-1]))
+
+
+@app.get("/api/products", response_class=FastJSONResponse)
+async def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    store_id: Optional[str] = None,
+    min_protein_per_dollar: Optional[float] = Query(default=None, ge=0),
+    min_protein_per_100cal: Optional[float] = Query(default=None, ge=0),
+    max_price: Optional[float] = Query(default=None, gt=0),
+    limit: int = Query(default=50, ge=1, le=PRODUCTS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = Query(default="json", description="ndjson streams every matching product, limit is ignored"),
+):
+    # a category and/or store page only goes stale when a product in that category/store changes
+    scope_category = category if category and category != "all" else None
+    etag = catalog_etag(request, catalog.scope_version(scope_category, store_id))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    after = decode_cursor(cursor) if cursor else None
+    filters = (category, store_id, min_protein_per_dollar, min_protein_per_100cal, max_price)
+
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_products(filters, after),
+            media_type="application/x-ndjson",
+            headers=catalog_headers(etag),
+        )
+
+    # one extra row tells us whether there's another page
+    products = await fetch_products_page(filters, after, limit + 1)
+    page = products[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(products) > limit else None
+
+    return FastJSONResponse(
+        {
+            "success": True,
+            "count": len(page),
+            "products": page,
+            "next_cursor": next_cursor,
+        },
+        headers=catalog_headers(etag),
     )
+
+
+@app.post("/api/optimize", response_class=FastJSONResponse)
+async def optimize(request: OptimizeRequest):
+    snapshot = await catalog.get()
+    cache_key = result_cache_key(request, snapshot.version)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return FastJSONResponse(cached)
+
+    view = await get_filtered_view(diet=request.diet, allergies=request.allergies, snapshot=snapshot)
     
-    if not products:
+    if not len(view):
         raise HTTPException(status_code=404, detail="No products available")
-    
-    result = optimize_basket(
-        products=products,
-        budget=request.budget,
+
+    # a catalog without store info (fallback data) can't be split by store, selected_store is ignored then.
+    # a chain we haven't scraped (the web app auto selects the nearest chain from its own store list)
+    # falls back to the whole catalog, flagged with store_fallback so the client can say so
+    store_ids = snapshot.stores.matching(chain=request.selected_store) if request.selected_store and len(snapshot.stores) else []
+    if store_ids:
+        result = best_store_result(*await solve_stores(view, store_ids, request))
+    else:
+        # solving is cpu bound, keep it off the event loop
+        result = await run_in_threadpool(
+            optimize_view,
+            view=view,
+            budget=round(request.budget, 2),
+            daily_calories=request.daily_calories,
+            daily_protein=request.daily_protein,
+            max_per_product=request.max_per_product,
+            solver=request.solver,
+            resolution_cents=request.budget_resolution_cents,
+            macros=request.macro_targets(),
+        )
+        if request.selected_store and len(snapshot.stores):
+            result["store_fallback"] = True
+
+    if result.get("status") == "infeasible":
+        raise HTTPException(status_code=422, detail=result["detail"])
+    if result.get("status") == "unavailable":
+        raise HTTPException(status_code=501, detail=result["detail"])
+    if result.get("status") == "timeout":
+        raise HTTPException(status_code=504, detail=result["detail"])
+
+    result_cache.set(cache_key, result)
+    return FastJSONResponse(result)
+
+
+# =============================================================================
+# MULTI STORE
+# =============================================================================
+# every store is solved on its own partition of the filtered view, all of them at once in the
+# threadpool (knapsack and milp spend their time in numpy/HiGHS, which release the GIL)
+
+def basket_rank(result: dict) -> tuple:
+    summary = result["summary"]
+    return (summary["total_protein"], -summary["total_cost"])
+
+
+async def solve_on(view: FilteredView, request: OptimizeRequest, budget: float) -> dict:
+    return await run_in_threadpool(
+        optimize_view,
+        view=view,
+        budget=round(budget, 2),
         daily_calories=request.daily_calories,
         daily_protein=request.daily_protein,
         max_per_product=request.max_per_product,
+        solver=request.solver,
+        resolution_cents=request.budget_resolution_cents,
+        macros=request.macro_targets(),
     )
-    
+
+
+# how bad a failed solve is, the worst one across stores is what gets reported when none succeed:
+# a missing solver or a time limit says nothing about whether a basket exists, infeasible does
+FAILURE_SEVERITY = {"no_products": 0, "infeasible": 1, "timeout": 2, "unavailable": 3}
+
+
+def worst_failure(failures: List[dict]) -> Optional[dict]:
+    return max(failures, key=lambda result: FAILURE_SEVERITY.get(result.get("status"), 1), default=None)
+
+
+def store_views(view: FilteredView, store_ids: List[str]) -> List[Tuple[str, FilteredView]]:
+    parts = [(store_id, view.for_stores([store_id])) for store_id in store_ids]
+    return [(store_id, store_view) for store_id, store_view in parts if len(store_view)]
+
+
+# the per store solves, best basket first with its store attached, plus the worst failure among
+# the stores that had none (None when every store solved)
+def rank_store_results(view: FilteredView, store_ids: List[str], solved: List[dict]) -> Tuple[List[dict], Optional[dict]]:
+    results = []
+    failures = []
+    for store_id, result in zip(store_ids, solved):
+        if result.get("success"):
+            results.append({**result, "store": view.snapshot.stores.info[store_id]})
+        else:
+            failures.append(result)
+    results.sort(key=basket_rank, reverse=True)
+    return results, worst_failure(failures)
+
+
+# what /api/optimize (and the batch route) answer for a chain: the best single store's basket
+def best_store_result(results: List[dict], failure: Optional[dict]) -> dict:
+    if not results:
+        return failure or {"success": False, "status": "infeasible", "detail": "No store has a basket for these settings"}
+    result = dict(results[0])
+    result["stores_compared"] = len(results)
     return result
 
 
-@app.get("/api/categories")
-def get_categories():
-    products = get_products_from_supabase()
-    categories = list(set(p.get("category", "other") for p in products))
-    return {"categories": sorted(categories)}
+# one basket per store with products in the view, see rank_store_results
+async def solve_stores(view: FilteredView, store_ids: List[str], request: OptimizeRequest) -> Tuple[List[dict], Optional[dict]]:
+    parts = store_views(view, store_ids)
+    solved = await asyncio.gather(*(solve_on(store_view, request, request.budget) for _, store_view in parts))
+    return rank_store_results(view, [store_id for store_id, _ in parts], solved)
+
+
+# cross store basket: every combination of the best few single store results is solved as one
+# partition with store_penalty taken off the budget per extra store, and it only wins if it
+# beats the best single store basket
+async def solve_split(view: FilteredView, results: List[dict], request: StoreOptimizeRequest) -> Optional[dict]:
+    leaders = [result["store"]["id"] for result in results[:request.max_split_stores]]
+    combos = [
+        combo
+        for size in range(2, len(leaders) + 1)
+        for combo in itertools.combinations(leaders, size)
+        if request.budget - request.store_penalty * (size - 1) > 0
+    ]
+    if not combos:
+        return None
+
+    solved = await asyncio.gather(*(
+        solve_on(view.for_stores(combo), request, request.budget - request.store_penalty * (len(combo) - 1))
+        for combo in combos
+    ))
+
+    best = None
+    for combo, result in zip(combos, solved):
+        if not result.get("success"):
+            continue
+        if best is None or basket_rank(result) > basket_rank(best[1]):
+            best = (combo, result)
+    if best is None or basket_rank(best[1]) <= basket_rank(results[0]):
+        return None
+
+    combo, result = best
+    columns = view.snapshot.columns
+    used = []
+    for item in result["items"]:
+        item["store_id"] = columns.products[columns.id_index[item["id"]]].get("store_id")
+        if item["store_id"] not in used:
+            used.append(item["store_id"])
+    result["stores"] = [view.snapshot.stores.info[store_id] for store_id in used]
+    result["store_penalty_total"] = round(request.store_penalty * (len(used) - 1), 2)
+    return result
+
+
+@app.post("/api/optimize/stores", response_class=FastJSONResponse)
+async def optimize_stores(request: StoreOptimizeRequest):
+    snapshot = await catalog.get()
+    near = request.latitude is not None and request.longitude is not None
+    cache_key = result_cache_key(request, snapshot.version) + (
+        "stores",
+        (round(request.latitude, 3), round(request.longitude, 3), request.radius_miles) if near else None,
+        (request.store_penalty, request.max_split_stores) if request.split else None,
+    )
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return FastJSONResponse({**cached, "catalog_version": snapshot.version})
+
+    if not len(snapshot.stores):
+        raise HTTPException(status_code=404, detail="Catalog has no store data")
+
+    store_ids = snapshot.stores.matching(
+        chain=request.selected_store,
+        latitude=request.latitude,
+        longitude=request.longitude,
+        radius_miles=request.radius_miles if near else None,
+    )
+    if not store_ids:
+        raise HTTPException(status_code=404, detail="No stores in range")
+
+    view = await get_filtered_view(diet=request.diet, allergies=request.allergies, snapshot=snapshot)
+    results, failure = await solve_stores(view, store_ids, request)
+    # no basket anywhere because the solver is missing or timed out isn't an answer, don't cache it
+    if not results and failure and failure.get("status") == "unavailable":
+        raise HTTPException(status_code=501, detail=failure["detail"])
+    if not results and failure and failure.get("status") == "timeout":
+        raise HTTPException(status_code=504, detail=failure["detail"])
+    if near:
+        for result in results:
+            distance = snapshot.stores.distance(result["store"]["id"], request.latitude, request.longitude)
+            result["store"] = {**result["store"], "distance_miles": round(distance, 1) if distance is not None else None}
+
+    split = await solve_split(view, results, request) if request.split and len(results) > 1 else None
+
+    # cached without the version, a delta can carry this entry over to a newer one
+    response = {
+        "success": bool(results),
+        "count": len(results),
+        "stores": results,
+        "split": split,
+    }
+    result_cache.set(cache_key, response)
+    return FastJSONResponse({**response, "catalog_version": snapshot.version})
+
+
+# cohorts of profiles in one call. requests are grouped by filter profile so each filtered
+# view is built and scored once, then every request in the group is solved against it.
+# a group at one chain is solved per store and each request gets its best single store basket,
+# the same answer (and cache entry) as /api/optimize
+@app.post("/api/optimize/batch", response_class=FastJSONResponse)
+async def optimize_batch(batch: BatchOptimizeRequest):
+    snapshot = await catalog.get()
+    by_store = bool(len(snapshot.stores))
+    groups: dict = {}
+    for index, request in enumerate(batch.requests):
+        chain = request.selected_store.strip().lower() if by_store and request.selected_store else None
+        key = (*normalize_filters(request.diet, request.allergies), chain)
+        groups.setdefault(key, []).append(index)
+
+    results: List[Optional[dict]] = [None] * len(batch.requests)
+    cache_keys = [result_cache_key(request, snapshot.version) for request in batch.requests]
+    jobs = []
+    job_indexes = []
+    for (diet, allergies, chain), indexes in groups.items():
+        cached = [(i, result_cache.get(cache_keys[i])) for i in indexes]
+        for i, result in cached:
+            results[i] = result
+        indexes = [i for i, result in cached if result is None]
+        if not indexes:
+            continue
+
+        view = await get_filtered_view(diet=diet, allergies=list(allergies), snapshot=snapshot)
+        if not len(view):
+            for index in indexes:
+                results[index] = {"success": False, "status": "no_products", "detail": "No products available"}
+            continue
+        # an unscraped chain gets the whole catalog, same as /api/optimize
+        store_ids = snapshot.stores.matching(chain=chain) if chain else []
+        parts = store_views(view, store_ids) if store_ids else [(None, view)]
+
+        params = [
+            {
+                "budget": round(batch.requests[i].budget, 2),
+                "daily_calories": batch.requests[i].daily_calories,
+                "daily_protein": batch.requests[i].daily_protein,
+                "max_per_product": batch.requests[i].max_per_product,
+                "solver": batch.requests[i].solver,
+                "resolution_cents": batch.requests[i].budget_resolution_cents,
+                "macros": batch.requests[i].macro_targets(),
+            }
+            for i in indexes
+        ]
+        with span("scoring"):
+            jobs.extend((scored_view(part), params) for _, part in parts)
+        job_indexes.append((indexes, view, [store_id for store_id, _ in parts], bool(chain) and not store_ids))
+
+    with span("solve"):
+        solved = iter(await run_in_threadpool(solve_batch, jobs))
+    for indexes, view, part_ids, fallback in job_indexes:
+        by_part = [next(solved) for _ in part_ids]
+        for n, index in enumerate(indexes):
+            if part_ids == [None]:
+                result = by_part[0][n]
+            else:
+                result = best_store_result(*rank_store_results(view, part_ids, [part[n] for part in by_part]))
+            if fallback:
+                result["store_fallback"] = True
+            results[index] = result
+            # failures (infeasible, a solver timeout) are answered per request, never from the cache
+            if result.get("success"):
+                result_cache.set(cache_keys[index], result)
+
+    return FastJSONResponse({
+        "success": True,
+        "count": len(results),
+        "groups": len(groups),
+        "catalog_version": snapshot.version,
+        "results": results,
+    })
+
+
+# small edits to a basket the user already has, repaired in place off the cached view and ranking
+@app.post("/api/optimize/repair", response_class=FastJSONResponse)
+async def optimize_repair(request: RepairRequest):
+    snapshot = await catalog.get()
+    view = await get_filtered_view(diet=request.diet, allergies=request.allergies, snapshot=snapshot)
+    # refills come from the basket's chain, an unscraped one falls back like /api/optimize
+    fallback = False
+    if request.selected_store and len(snapshot.stores):
+        store_ids = snapshot.stores.matching(chain=request.selected_store)
+        fallback = not store_ids
+        if store_ids:
+            view = view.for_stores(store_ids)
+    if not len(view):
+        raise HTTPException(status_code=404, detail="No products available")
+
+    previous: dict = {}
+    for item in request.items:
+        previous[item.id] = previous.get(item.id, 0) + item.quantity
+
+    with span("scoring"):
+        scored = scored_view(view)
+
+    with span("solve"):
+        result = await run_in_threadpool(
+            repair_basket,
+            scored=scored,
+            previous=previous,
+            budget=round(request.budget, 2),
+            daily_calories=request.daily_calories,
+            daily_protein=request.daily_protein,
+            max_per_product=request.max_per_product,
+            exclude_ids=request.exclude_ids,
+        )
+    result["solver"] = "greedy"
+    if fallback:
+        result["store_fallback"] = True
+    return FastJSONResponse(result)
+
+
+@app.post("/api/optimize/frontier", response_class=FastJSONResponse)
+async def optimize_frontier(request: FrontierRequest):
+    snapshot = await catalog.get()
+    diet, allergies = normalize_filters(request.diet, request.allergies)
+    key = (snapshot.version, diet, allergies, request.max_per_product)
+
+    frontier = frontier_cache.get(key)
+    if frontier is None:
+        view = await get_filtered_view(diet=diet, allergies=list(allergies), snapshot=snapshot)
+        if not len(view):
+            raise HTTPException(status_code=404, detail="No products available")
+        with span("scoring"):
+            scored = scored_view(view)
+        with span("solve"):
+            frontier = await run_in_threadpool(pareto_frontier, scored, FRONTIER_MAX_BUDGET, request.max_per_product)
+        frontier_cache.set(key, frontier)
+
+    points = [point for point in frontier if point["total_cost"] <= request.budget]
+    return FastJSONResponse({
+        "success": True,
+        "catalog_version": snapshot.version,
+        "budget": request.budget,
+        "count": len(points),
+        "points": points,
+    })
+
+
+# cache and catalog numbers are read when prometheus scrapes, nothing extra on the request path
+metrics.watch_cache("results", result_cache.stats)
+metrics.watch_cache("frontier", frontier_cache.stats)
+metrics.watch_cache("recipes_memory", recipe_cache.memory.stats)
+metrics.watch_cache("recipes_table", recipe_cache.table_stats)
+metrics.catalog_info.collect_from(lambda: [
+    (("version",), catalog.version),
+    (("products",), len(catalog.snapshot.products) if catalog.snapshot else 0),
+    (("age_seconds",), round(catalog.snapshot.age(), 1) if catalog.snapshot else 0),
+])
+metrics.catalog_info.collect_from(lambda: [
+    (("mirror_products",), len(mirror)),
+    (("mirror_age_seconds",), round(mirror.age(), 1)),
+] if mirror is not None and mirror.synced_at else [])
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {
+        "catalog_version": catalog.version,
+        "results": result_cache.stats(),
+        "frontier": frontier_cache.stats(),
+        "recipes": recipe_cache.stats(),
+    }
+
+
+# straight from the category index built with the catalog. diet/allergies narrow the counts
+# to what that profile can actually buy, the metric ranges are always catalog wide
+@app.get("/api/categories", response_class=FastJSONResponse)
+async def get_categories(
+    request: Request,
+    diet: Optional[str] = None,
+    allergies: List[str] = Query(default=[]),
+):
+    snapshot = await catalog.get()
+    etag = catalog_etag(request, snapshot.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    index = snapshot.categories
+
+    if diet or allergies:
+        view = await get_filtered_view(diet=diet, allergies=allergies, snapshot=snapshot)
+        counts = index.counts(view.row_bits)
+    else:
+        counts = {name: index.summary[name]["count"] for name in index.names}
+
+    return FastJSONResponse(
+        {
+            "categories": index.names,
+            "facets": {name: {**index.summary[name], "count": counts.get(name, 0)} for name in index.names},
+        },
+        headers=catalog_headers(etag),
+    )
 
 # =============================================================================
 # RECIPE ROUTES (Spoonacular)
 # =============================================================================    
     
+# upstream errors (quota, bad key) turn into a 502 and never reach the cache
+async def spoonacular_get(path: str, params: dict):
+    try:
+        with upstream("spoonacular", path):
+            resp = await spoonacular.get(path, params={**params, "apiKey": SPOONACULAR_API_KEY})
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Spoonacular unreachable: {type(e).__name__}")
+    # don't echo the upstream url back, it has the api key in it
+    if resp.status_code != 200:
+        metrics.upstream_errors.inc(service="spoonacular", target=path)
+        raise HTTPException(status_code=502, detail=f"Spoonacular error {resp.status_code}")
+    return resp.json()
+
+
 @app.get("/api/recipes/from-ingredients")
 async def recipes_from_ingredients(
     ingredients: List[str] = Query(default=[]),
@@ -365,17 +1247,13 @@ async def recipes_from_ingredients(
     if not ingredients:
         raise HTTPException(status_code=400, detail="No ingredients provided")
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            "https://api.spoonacular.com/recipes/findByIngredients",
-            params={
-                "ingredients": ",".join(ingredients),
-                "number": number,
-                "ranking": 2,
-                "apiKey": SPOONACULAR_API_KEY
-            }
-        )
-        data = resp.json()
+    # sorted so the same basket in a different order is the same cache entry
+    params = {"ingredients": ",".join(sorted(ingredients)), "number": number, "ranking": 2}
+
+    async def fetch() -> List[dict]:
+        return await spoonacular_get("/recipes/findByIngredients", params)
+
+    data = await recipe_cache.get_or_fetch("ingredients", params, fetch)
     
     return {
         "ingredients": ingredients,
@@ -400,20 +1278,19 @@ async def search_recipes(
     if not SPOONACULAR_API_KEY:
         raise HTTPException(status_code=500, detail="SPOONACULAR_API_KEY not configured")
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            "https://api.spoonacular.com/recipes/complexSearch",
-            params={
-                "query": query,
-                "number": number,
-                "addRecipeNutrition": True,
-                "apiKey": SPOONACULAR_API_KEY
-            }
+    async def fetch() -> List[dict]:
+        data = await spoonacular_get(
+            "/recipes/complexSearch",
+            {"query": query, "number": number, "addRecipeNutrition": True},
         )
-        data = resp.json()
+        return data.get("results", [])
+
+    # same key shape as recipe_cache.search_recipes so both sides share entries
+    cache_params = {"query": query.lower().strip(), "number": number}
+    data = await recipe_cache.get_or_fetch("search", cache_params, fetch)
     
     results = []
-    for r in data.get("results", []):
+    for r in data:
         nutrition = r.get("nutrition", {})
         nutrients = {n["name"]: n["amount"] for n in nutrition.get("nutrients", [])}
         results.append({
@@ -0,0 +1,236 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# =============================================================================
+# METRICS
+# =============================================================================
+# tiny prometheus style counters and histograms, rendered in the text exposition format on
+# /metrics. no client library, the app only needs a handful of series and a lock per metric.
+# request stages (catalog fetch, filters, scoring, solve, serialization) are timed with span(),
+# which also records into the current request's stage dict so the middleware can add a
+# Server-Timing header. the dict lives in a contextvar, threadpool work inherits it.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# values that already live somewhere else (cache counters, catalog age), read when scraped
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._collectors: List[Callable[[], Iterable[Tuple[Labels, float]]]] = []
+
+    def collect_from(self, collector: Callable[[], Iterable[Tuple[Labels, float]]]) -> None:
+        self._collectors.append(collector)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for collector in self._collectors:
+            try:
+                for key, value in collector():
+                    lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        return lines
+
+
+# same, for values that only ever go up (hit/miss counts kept by the cache itself)
+class CollectedCounter(Gauge):
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "cuenta_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"),
+))
+http_seconds = registry.register(Histogram(
+    "cuenta_http_request_duration_seconds", "HTTP request latency", ("method", "route"),
+))
+stage_seconds = registry.register(Histogram(
+    "cuenta_stage_duration_seconds", "Time spent in one stage of a request", ("route", "stage"),
+))
+upstream_seconds = registry.register(Histogram(
+    "cuenta_upstream_duration_seconds", "Latency of calls to Supabase and Spoonacular", ("service", "target"),
+))
+upstream_errors = registry.register(Counter(
+    "cuenta_upstream_errors_total", "Failed calls to Supabase and Spoonacular", ("service", "target"),
+))
+cache_hits = registry.register(CollectedCounter("cuenta_cache_hits_total", "Cache hits since start", ("cache",)))
+cache_misses = registry.register(CollectedCounter("cuenta_cache_misses_total", "Cache misses since start", ("cache",)))
+cache_hit_ratio = registry.register(Gauge("cuenta_cache_hit_ratio", "Cache hits over lookups since start", ("cache",)))
+cache_entries = registry.register(Gauge("cuenta_cache_entries", "Entries currently cached", ("cache",)))
+cache_invalidations = registry.register(Counter(
+    "cuenta_cache_invalidations_total", "Cached entries dropped or kept when a catalog delta landed", ("cache", "outcome"),
+))
+catalog_info = registry.register(Gauge("cuenta_catalog", "Catalog snapshot version, size and age", ("field",)))
+
+
+# anything with an LRUCache style stats() dict shows up in the cache gauges under its name
+def watch_cache(name: str, stats: Callable[[], Dict[str, float]]) -> None:
+    cache_hits.collect_from(lambda: [((name,), stats()["hits"])])
+    cache_misses.collect_from(lambda: [((name,), stats()["misses"])])
+    cache_hit_ratio.collect_from(lambda: [((name,), stats()["hit_ratio"])])
+    cache_entries.collect_from(lambda: [((name,), stats()["size"])])
+
+
+# =============================================================================
+# REQUEST STAGES
+# =============================================================================
+
+_route: ContextVar[str] = ContextVar("metrics_route", default="")
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("metrics_stages", default=None)
+
+
+def start_request(route: str) -> Dict[str, float]:
+    stages: Dict[str, float] = {}
+    _route.set(route)
+    _stages.set(stages)
+    return stages
+
+
+# time one stage. nests fine, and outside a request (scripts, the refresher) it only feeds the histogram
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, route=_route.get() or "background", stage=stage)
+        stages = _stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def upstream(service: str, target: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        upstream_errors.inc(service=service, target=target)
+        raise
+    finally:
+        upstream_seconds.observe(time.perf_counter() - start, service=service, target=target)
+
+
+def server_timing(stages: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stages.items())
+
+
+def render() -> str:
+    return registry.render()
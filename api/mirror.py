@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from metrics import span
+
+MIRROR_PATH = os.getenv(
+    "MIRROR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalog_mirror.sqlite3")
+)
+MIRROR_MAX_STALENESS_SECONDS = float(os.getenv("MIRROR_MAX_STALENESS_SECONDS", "900"))
+MIRROR_FULL_SYNC_SECONDS = float(os.getenv("MIRROR_FULL_SYNC_SECONDS", "86400"))
+MIRROR_SYNC_OVERLAP_SECONDS = float(os.getenv("MIRROR_SYNC_OVERLAP_SECONDS", "60"))
+MIRROR_PAGE_SIZE = 1000  # supabase caps a response at 1000 rows anyway
+
+# =============================================================================
+# LOCAL CATALOG MIRROR
+# =============================================================================
+# products only change when a scraper runs, so the api keeps a sqlite copy of products and stores
+# instead of asking supabase every time. sync() pulls the rows whose last_updated moved past the
+# watermark (the product_updated trigger bumps it on every write). the overlap re-reads the last
+# minute in case a long transaction committed rows stamped before the watermark, and a full resync
+# every MIRROR_FULL_SYNC_SECONDS is what picks up deletes.
+# whole rows are kept as json, the columns people filter on are pulled out and indexed next to them.
+# a failed sync keeps serving the old copy until it's MIRROR_MAX_STALENESS_SECONDS old, after that
+# is_fresh() says no and callers go back to supabase.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    store_id TEXT,
+    category TEXT,
+    price REAL,
+    protein REAL,
+    protein_per_dollar REAL,
+    protein_per_100cal REAL,
+    last_updated TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_ppd ON products(protein_per_dollar DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_store ON products(store_id, protein_per_dollar DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, protein_per_dollar DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS stores (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+PRODUCT_FIELDS = ("id", "store_id", "category", "price", "protein", "protein_per_dollar", "protein_per_100cal", "last_updated")
+
+
+# where to read from so rows that committed late (stamped a little before the watermark) still come back
+def overlap_since(watermark: Optional[str], overlap: float = MIRROR_SYNC_OVERLAP_SECONDS) -> Optional[str]:
+    if not watermark:
+        return None
+    try:
+        return (datetime.fromisoformat(watermark) - timedelta(seconds=overlap)).isoformat()
+    except ValueError:
+        return watermark
+
+
+# products with last_updated at or after since (all of them when since is None), oldest first.
+# keyset pages on (last_updated, id) so rows sharing a timestamp aren't skipped at a page edge.
+# the change feed polls with this too when there's no mirror, hence columns
+async def fetch_products_since(db: Any, since: Optional[str], columns: str = "*") -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    after: Optional[Tuple[str, str]] = None
+    while True:
+        params: List[Tuple[str, Any]] = []
+        if after is not None:
+            ts, pid = after
+            params.append(("or", f'(last_updated.gt."{ts}",and(last_updated.eq."{ts}",id.gt.{pid}))'))
+        elif since:
+            params.append(("last_updated", f"gte.{since}"))
+
+        page = await db.select("products", columns=columns, params=params, order="last_updated.asc,id.asc", limit=MIRROR_PAGE_SIZE)
+        rows.extend(page)
+        if len(page) < MIRROR_PAGE_SIZE:
+            return rows
+        after = (page[-1]["last_updated"], page[-1]["id"])
+
+
+def _product_row(product: Dict[str, Any]) -> tuple:
+    return tuple(product.get(field) for field in PRODUCT_FIELDS) + (json.dumps(product),)
+
+
+class CatalogMirror:
+    def __init__(
+        self,
+        path: str = MIRROR_PATH,
+        max_staleness: float = MIRROR_MAX_STALENESS_SECONDS,
+        full_sync_every: float = MIRROR_FULL_SYNC_SECONDS,
+        overlap: float = MIRROR_SYNC_OVERLAP_SECONDS,
+    ):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.full_sync_every = full_sync_every
+        self.overlap = overlap
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # wal lets the reader keep answering while a sync is writing, each side has its own connection
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._reader = self._connect()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._sync_lock = asyncio.Lock()
+
+        self.watermark: Optional[str] = self._meta("watermark")
+        self.synced_at = float(self._meta("synced_at") or 0)
+        self.full_synced_at = float(self._meta("full_synced_at") or 0)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _query(self, sql: str, args: Sequence[Any] = ()) -> List[tuple]:
+        with self._read_lock:
+            return self._reader.execute(sql, args).fetchall()
+
+    def _meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def close(self) -> None:
+        self._reader.close()
+        self._writer.close()
+
+    # =========================================================================
+    # SYNC
+    # =========================================================================
+
+    def age(self) -> float:
+        return time.time() - self.synced_at if self.synced_at else float("inf")
+
+    def is_fresh(self) -> bool:
+        return self.age() < self.max_staleness
+
+    def _since(self) -> Optional[str]:
+        return overlap_since(self.watermark, self.overlap)
+
+    # the overlap means every sync re-reads the last minute, only rows whose data actually differs
+    # from what's stored count as changed (and get written)
+    def _changed(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        ids = [p["id"] for p in products if p.get("id")]
+        stored: Dict[str, str] = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            stored.update(self._query(
+                f"SELECT id, data FROM products WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        return [p for p in products if p.get("id") and stored.get(p["id"]) != json.dumps(p)]
+
+    def _unknown_stores(self, products: List[Dict[str, Any]]) -> bool:
+        store_ids = list({p["store_id"] for p in products if p.get("store_id")})
+        if not store_ids:
+            return False
+        known = self._query(f"SELECT COUNT(*) FROM stores WHERE id IN ({', '.join('?' * len(store_ids))})", store_ids)
+        return known[0][0] < len(store_ids)
+
+    # returns the product rows that changed. stores have no last_updated and the table is tiny, so it's
+    # re-read whole on a full sync or when a changed product points at a store we haven't seen
+    async def sync(self, db: Any, full: bool = False) -> List[Dict[str, Any]]:
+        async with self._sync_lock:
+            full = full or not self.watermark or time.time() - self.full_synced_at > self.full_sync_every
+            with span("mirror_sync"):
+                products = await fetch_products_since(db, None if full else self._since())
+                changed = products if full else await asyncio.to_thread(self._changed, products)
+                stores = await db.select("stores") if full or await asyncio.to_thread(self._unknown_stores, changed) else None
+                # rows come back ordered by last_updated, so the last one is the newest
+                watermark = next((p["last_updated"] for p in reversed(products) if p.get("last_updated")), self.watermark)
+                await asyncio.to_thread(self._apply, changed, stores, watermark, full)
+            return changed
+
+    def _apply(
+        self,
+        products: List[Dict[str, Any]],
+        stores: Optional[List[Dict[str, Any]]],
+        watermark: Optional[str],
+        full: bool,
+    ) -> None:
+        now = time.time()
+        meta = [("synced_at", str(now)), ("watermark", watermark)]
+        if full:
+            meta.append(("full_synced_at", str(now)))
+
+        with self._write_lock, self._writer:
+            if full:
+                self._writer.execute("DELETE FROM products")
+            self._writer.executemany(
+                f"INSERT OR REPLACE INTO products ({', '.join(PRODUCT_FIELDS)}, data) "
+                f"VALUES ({', '.join('?' * (len(PRODUCT_FIELDS) + 1))})",
+                [_product_row(p) for p in products if p.get("id")],
+            )
+            if stores is not None:
+                self._writer.execute("DELETE FROM stores")
+                self._writer.executemany(
+                    "INSERT INTO stores (id, data) VALUES (?, ?)",
+                    [(s["id"], json.dumps(s)) for s in stores if s.get("id")],
+                )
+            self._writer.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta)
+
+        self.watermark = watermark
+        self.synced_at = now
+        if full:
+            self.full_synced_at = now
+
+    # =========================================================================
+    # READS
+    # =========================================================================
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM products")[0][0]
+
+    # same rows and shape as the api's catalog query: just these columns, the store row embedded as "stores"
+    def catalog(self, columns: Sequence[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        sql = (
+            "SELECT p.data, s.data FROM products p LEFT JOIN stores s ON s.id = p.store_id "
+            "WHERE p.protein > 0 AND p.price > 0 ORDER BY p.protein_per_dollar DESC"
+        )
+        args: List[Any] = []
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [self._catalog_row(product, store, columns) for product, store in self._query(sql, args)]
+
+    # the same shape for specific products (what the change feed hands the catalog), qualifying or not
+    def catalog_rows(self, ids: Sequence[str], columns: Sequence[str]) -> List[Dict[str, Any]]:
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = list(ids[start:start + 500])
+            rows.extend(self._query(
+                "SELECT p.data, s.data FROM products p LEFT JOIN stores s ON s.id = p.store_id "
+                f"WHERE p.id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return [self._catalog_row(product, store, columns) for product, store in rows]
+
+    @staticmethod
+    def _catalog_row(product_data: str, store_data: Optional[str], columns: Sequence[str]) -> Dict[str, Any]:
+        row = json.loads(product_data)
+        product = {column: row.get(column) for column in columns}
+        product["stores"] = json.loads(store_data) if store_data else None
+        return product
+
+    # the /api/products query (see product_filters in main.py), cursor included
+    def page(
+        self,
+        category: Optional[str],
+        store_id: Optional[str],
+        min_protein_per_dollar: Optional[float],
+        min_protein_per_100cal: Optional[float],
+        max_price: Optional[float],
+        after: Optional[tuple],
+        limit: int,
+    ) -> List[Dict[str, Any]]:
+        where = ["protein > 0", "price > 0"]
+        args: List[Any] = []
+        if category and category != "all":
+            where.append("category = ?")
+            args.append(category)
+        if store_id:
+            where.append("store_id = ?")
+            args.append(store_id)
+        if min_protein_per_dollar is not None:
+            where.append("protein_per_dollar >= ?")
+            args.append(min_protein_per_dollar)
+        if min_protein_per_100cal is not None:
+            where.append("protein_per_100cal >= ?")
+            args.append(min_protein_per_100cal)
+        if max_price is not None:
+            where.append("price <= ?")
+            args.append(max_price)
+        if after is not None:
+            ppd, pid = after
+            where.append("(protein_per_dollar < ? OR (protein_per_dollar = ? AND id < ?))")
+            args.extend([ppd, ppd, pid])
+
+        sql = (
+            f"SELECT data FROM products WHERE {' AND '.join(where)} "
+            "ORDER BY protein_per_dollar DESC, id DESC LIMIT ?"
+        )
+        return [json.loads(data) for (data,) in self._query(sql, [*args, limit])]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "products": len(self),
+            "fresh": self.is_fresh(),
+            "age_seconds": round(self.age(), 1) if self.synced_at else None,
+            "watermark": self.watermark,
+        }
@@ -0,0 +1,620 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from catalog import FilteredView, ProductColumns
+from metrics import span
+
+# scipy ships HiGHS, only the milp solver needs it
+try:
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+SOLVERS = ("greedy", "knapsack", "milp")
+MACROS = ("protein", "calories", "fat", "carbs", "fiber")
+MILP_TIME_LIMIT_SECONDS = float(os.getenv("MILP_TIME_LIMIT_SECONDS", "2"))
+
+# knapsack knobs. the budget is split into cells of KNAPSACK_RESOLUTION_CENTS, and the
+# resolution is coarsened automatically so neither the dp row nor the reconstruction table
+# (one bit per piece per cell) grows past these limits, whatever the budget or catalog size
+KNAPSACK_RESOLUTION_CENTS = int(os.getenv("KNAPSACK_RESOLUTION_CENTS", "1"))
+KNAPSACK_MAX_CELLS = int(os.getenv("KNAPSACK_MAX_CELLS", "10000"))
+KNAPSACK_MAX_TABLE_BYTES = int(os.getenv("KNAPSACK_MAX_TABLE_BYTES", str(16 * 1024 * 1024)))
+
+# frontier: how many budget levels get reconstructed per objective, the table is only built once
+FRONTIER_SAMPLES = int(os.getenv("FRONTIER_SAMPLES", "60"))
+
+# batches bigger than this get spread over worker processes, smaller ones are solved inline
+BATCH_POOL_THRESHOLD = int(os.getenv("BATCH_POOL_THRESHOLD", "200"))
+BATCH_POOL_WORKERS = int(os.getenv("BATCH_POOL_WORKERS", str(os.cpu_count() or 2)))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "50"))
+
+# =============================================================================
+# SCORING
+# =============================================================================
+# everything here works on the columns from catalog.py. scoring is a couple of array ops,
+# the ranking is one stable argsort, and both are memoized per filtered view so repeat
+# profiles skip straight to the basket loop.
+
+class ScoredColumns:
+    def __init__(self, columns: ProductColumns):
+        self.columns = columns
+        self.total_protein = columns.protein * columns.servings
+        self.total_calories = columns.calories * columns.servings
+
+        valid = (columns.price > 0) & (columns.protein > 0)
+        safe_price = np.where(valid, columns.price, 1.0)
+        self.protein_per_dollar = np.where(valid, self.total_protein / safe_price, 0.0)
+        self.candidates = np.flatnonzero(valid)
+        self._order = None
+
+    # candidate rows by protein per dollar, best first. stable so ties keep catalog order
+    @property
+    def order(self) -> np.ndarray:
+        if self._order is None:
+            scores = self.protein_per_dollar[self.candidates]
+            self._order = self.candidates[np.argsort(-scores, kind="stable")]
+        return self._order
+
+
+def scored_view(view: FilteredView) -> ScoredColumns:
+    return view.derived("scored", lambda v: ScoredColumns(v.columns))
+
+
+# =============================================================================
+# RESULT BUILDING
+# =============================================================================
+# quantities is product id -> (row, qty) in the order items were added, only now do we touch dicts
+
+def _basket_items(scored: ScoredColumns, quantities: Dict[str, tuple]) -> List[dict]:
+    columns = scored.columns
+    items = []
+    for pid, (row, qty) in quantities.items():
+        product = columns.products[row]
+        price = float(columns.price[row])
+        score = float(scored.protein_per_dollar[row])
+        items.append({
+            "id": pid,
+            "name": product["name"],
+            "quantity": qty,
+            "unit_price": price,
+            "total_price": qty * price,
+            "total_protein": qty * float(scored.total_protein[row]),
+            "total_calories": qty * float(scored.total_calories[row]),
+            "fitness_score": score,
+            "reason": f"{score:.1f}g protein per dollar",
+            "category": product.get("category", "other"),
+        })
+    return items
+
+
+def _build_result(
+    scored: ScoredColumns,
+    quantities: Dict[str, tuple],
+    budget: float,
+    daily_calories: int,
+) -> dict:
+    basket = _basket_items(scored, quantities)
+    weekly_calorie_target = daily_calories * 7
+
+    total_cost = sum(item["total_price"] for item in basket)
+    total_protein = sum(item["total_protein"] for item in basket)
+    total_calories = sum(item["total_calories"] for item in basket)
+
+    # good to calculate budget util
+    budget_util = (total_cost / budget * 100) if budget > 0 else 0
+    calorie_achievement = (total_calories / weekly_calorie_target * 100) if weekly_calorie_target > 0 else 0
+
+    return {
+        "success": True,
+        "status": "optimized",
+        "summary": {
+            "total_cost": round(total_cost, 2),
+            "total_protein": round(total_protein, 1),
+            "total_calories": round(total_calories, 0),
+            "budget": budget,
+            "calorie_target": weekly_calorie_target,
+            "budget_utilization": f"{budget_util:.1f}%",
+            "calorie_achievement": f"{calorie_achievement:.1f}%",
+        },
+        "items": basket,
+    }
+
+
+# =============================================================================
+# GREEDY
+# =============================================================================
+# greed is a sin. one pass down the ranking, take a unit of anything that still fits
+
+# walk the ranking and add one unit per row while it fits. quantities can come in already
+# filled (a basket being repaired), its totals count toward the budget and the early stop,
+# and anything in skip is treated as already visited
+def _greedy_fill(
+    scored: ScoredColumns,
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int,
+    quantities: Optional[Dict[str, tuple]] = None,
+    skip: frozenset = frozenset(),
+) -> Dict[str, tuple]:
+    weekly_protein_target = daily_protein * 7
+    weekly_calorie_target = daily_calories * 7
+
+    ids = scored.columns.ids
+    prices = scored.columns.price
+    quantities = {} if quantities is None else quantities
+    total_cost = 0.0
+    total_protein = 0.0
+    total_calories = 0.0
+    for row, qty in quantities.values():
+        total_cost += qty * float(prices[row])
+        total_protein += qty * float(scored.total_protein[row])
+        total_calories += qty * float(scored.total_calories[row])
+
+    for row in scored.order.tolist():
+        # Stop if we've hit targets and therefore don't need more
+        if total_protein >= weekly_protein_target and total_calories >= weekly_calorie_target * 0.8:
+            break
+
+        pid = ids[row]
+        if pid in skip:
+            continue
+        price = float(prices[row])
+        first_row, qty = quantities.get(pid, (row, 0))
+
+        # Check constraints
+        if qty >= max_per_product:
+            continue
+        if total_cost + price > budget:
+            continue
+
+        quantities[pid] = (first_row, qty + 1)
+        total_cost += price
+        total_protein += float(scored.total_protein[row])
+        total_calories += float(scored.total_calories[row])
+
+    return quantities
+
+
+def greedy_basket(
+    scored: ScoredColumns,
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int = 3,
+) -> dict:
+    quantities = _greedy_fill(scored, budget, daily_calories, daily_protein, max_per_product)
+    return _build_result(scored, quantities, budget, daily_calories)
+
+
+# =============================================================================
+# INCREMENTAL REPAIR
+# =============================================================================
+# the receipt ui nudges one thing at a time (budget slider, drop an item, max per product), so
+# instead of solving from scratch we start from the basket the user already has: drop what's gone
+# or excluded, clip quantities, shed the worst protein per dollar units until it fits the budget,
+# then top it up greedily from the view's cached ranking.
+
+def repair_basket(
+    scored: ScoredColumns,
+    previous: Dict[str, int],
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int = 3,
+    exclude_ids: Optional[List[str]] = None,
+) -> dict:
+    columns = scored.columns
+    skip = frozenset(exclude_ids or ())
+
+    quantities: Dict[str, tuple] = {}
+    for pid, qty in previous.items():
+        row = columns.id_index.get(pid)
+        # gone from the catalog, filtered out by diet/allergies, or excluded by the user
+        if row is None or pid in skip or scored.protein_per_dollar[row] <= 0:
+            continue
+        quantities[pid] = (row, min(qty, max_per_product))
+
+    total_cost = sum(qty * float(columns.price[row]) for row, qty in quantities.values())
+    worst_first = sorted(quantities, key=lambda pid: scored.protein_per_dollar[quantities[pid][0]])
+    for pid in worst_first:
+        row, qty = quantities[pid]
+        price = float(columns.price[row])
+        while qty and total_cost > budget + 1e-9:
+            qty -= 1
+            total_cost -= price
+        if qty:
+            quantities[pid] = (row, qty)
+        else:
+            del quantities[pid]
+        if total_cost <= budget + 1e-9:
+            break
+
+    # rows already in the basket had their turn in the original pass, only new rows get filled
+    visited = skip | frozenset(quantities)
+    quantities = _greedy_fill(scored, budget, daily_calories, daily_protein, max_per_product, quantities, visited)
+    chosen = {row: qty for row, qty in quantities.values()}
+    result = _build_result(scored, _ranked_quantities(scored, chosen), budget, daily_calories)
+    result["status"] = "repaired"
+
+    after = {pid: qty for pid, (row, qty) in quantities.items()}
+    result["changes"] = [
+        {"id": pid, "before": previous.get(pid, 0), "after": after.get(pid, 0)}
+        for pid in list(previous) + [pid for pid in after if pid not in previous]
+        if previous.get(pid, 0) != after.get(pid, 0)
+    ]
+    return result
+
+
+# =============================================================================
+# BOUNDED KNAPSACK
+# =============================================================================
+# exact (at the chosen resolution) max protein for the budget. each product can be bought
+# up to max_per_product times, which is binary split into 1, 2, 4, ... pieces so the dp stays
+# a plain 0/1 knapsack over integer cells. item costs round UP to a cell so we never go over.
+
+class KnapsackTable:
+    def __init__(
+        self,
+        scored: ScoredColumns,
+        budget: float,
+        max_per_product: int,
+        values: Optional[np.ndarray] = None,
+        resolution_cents: Optional[int] = None,
+    ):
+        self.scored = scored
+        values = scored.total_protein if values is None else values
+        rows = scored.order
+        prices_cents = np.round(scored.columns.price[rows] * 100).astype(np.int64)
+        budget_cents = int(math.floor(budget * 100 + 1e-6))
+
+        resolution = max(resolution_cents or KNAPSACK_RESOLUTION_CENTS, 1)
+        resolution = max(resolution, math.ceil(budget_cents / KNAPSACK_MAX_CELLS))
+
+        # pieces depend on the resolution and the table size depends on the pieces,
+        # so coarsen until the reconstruction table fits in memory
+        while True:
+            capacity = budget_cents // resolution
+            weights = -(-prices_cents // resolution)  # ceil division
+            pieces = self._split(rows, weights, capacity, max_per_product)
+            table_bytes = len(pieces) * ((capacity + 8) // 8)
+            if table_bytes <= KNAPSACK_MAX_TABLE_BYTES or capacity <= 1:
+                break
+            resolution = max(resolution + 1, math.ceil(resolution * table_bytes / KNAPSACK_MAX_TABLE_BYTES))
+
+        self.resolution = resolution
+        self.capacity = capacity
+        self.pieces = pieces
+
+        dp = np.zeros(capacity + 1, dtype=np.float64)
+        keep = np.zeros((len(pieces), (capacity + 8) // 8), dtype=np.uint8)
+        taken = np.zeros(capacity + 1, dtype=bool)
+
+        for k, (row, weight, count) in enumerate(pieces):
+            candidate = dp[: capacity + 1 - weight] + values[row] * count
+            take = candidate > dp[weight:]
+            if not take.any():
+                continue
+            dp[weight:] = np.where(take, candidate, dp[weight:])
+            taken[:weight] = False
+            taken[weight:] = take
+            keep[k] = np.packbits(taken)
+
+        self.dp = dp
+        self.keep = keep
+
+    @staticmethod
+    def _split(rows: np.ndarray, weights: np.ndarray, capacity: int, max_per_product: int) -> List[tuple]:
+        pieces = []
+        for row, weight in zip(rows.tolist(), weights.tolist()):
+            if weight > capacity:
+                continue
+            weight = max(weight, 1)
+            remaining = min(max_per_product, capacity // weight)
+            count = 1
+            while remaining > 0:
+                take = min(count, remaining)
+                pieces.append((row, weight * take, take))
+                remaining -= take
+                count *= 2
+        return pieces
+
+    def _kept(self, k: int, cell: int) -> bool:
+        return bool((self.keep[k, cell >> 3] >> (7 - (cell & 7))) & 1)
+
+    # walk the table backwards from a capacity, row -> quantity
+    def quantities_at(self, cell: Optional[int] = None) -> Dict[int, int]:
+        cell = self.capacity if cell is None else cell
+        chosen: Dict[int, int] = {}
+        for k in range(len(self.pieces) - 1, -1, -1):
+            row, weight, count = self.pieces[k]
+            if weight <= cell and self._kept(k, cell):
+                chosen[row] = chosen.get(row, 0) + count
+                cell -= weight
+        return chosen
+
+
+def _ranked_quantities(scored: ScoredColumns, chosen: Dict[int, int]) -> Dict[str, tuple]:
+    quantities: Dict[str, tuple] = {}
+    for row in scored.order.tolist():
+        if row in chosen:
+            quantities[scored.columns.ids[row]] = (row, chosen[row])
+    return quantities
+
+
+def knapsack_basket(
+    scored: ScoredColumns,
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int = 3,
+    resolution_cents: Optional[int] = None,
+) -> dict:
+    table = KnapsackTable(scored, budget, max_per_product, resolution_cents=resolution_cents)
+    quantities = _ranked_quantities(scored, table.quantities_at())
+    result = _build_result(scored, quantities, budget, daily_calories)
+    result["resolution_cents"] = table.resolution
+    return result
+
+
+# =============================================================================
+# MACRO MILP
+# =============================================================================
+# integer program: how many of each product, max total protein, with the budget, max_per_product
+# and any min/max weekly macro targets as constraints, solved locally by HiGHS through scipy.
+# the constraint matrix only depends on the filtered view, so it's built once per view and
+# each solve just swaps in new bound vectors. (scipy doesn't expose a MIP start, so "warm" here
+# means skipping the model build, not seeding the branch and bound.)
+
+class MilpTemplate:
+    def __init__(self, scored: ScoredColumns):
+        columns = scored.columns
+        rows = scored.candidates
+        servings = columns.servings[rows]
+        self.rows = rows
+        self.totals = {
+            "price": columns.price[rows],
+            "protein": scored.total_protein[rows],
+            "calories": scored.total_calories[rows],
+            "fat": columns.fat[rows] * servings,
+            "carbs": columns.carbs[rows] * servings,
+            "fiber": columns.fiber[rows] * servings,
+        }
+        self.matrix = np.vstack([self.totals[name] for name in ("price", *MACROS)])
+        # max protein, and among equal protein baskets the cheaper one
+        self.objective = -self.totals["protein"] + 1e-6 * self.totals["price"]
+        self.integrality = np.ones(len(rows))
+
+    def solve(self, budget: float, max_per_product: int, macros: Dict[str, Dict[str, Optional[float]]]):
+        lower = [0.0]
+        upper = [budget]
+        for name in MACROS:
+            bounds = macros.get(name) or {}
+            lower.append(bounds.get("min") if bounds.get("min") is not None else 0.0)
+            upper.append(bounds.get("max") if bounds.get("max") is not None else np.inf)
+
+        return milp(
+            self.objective,
+            integrality=self.integrality,
+            bounds=Bounds(0, max_per_product),
+            constraints=LinearConstraint(self.matrix, lower, upper),
+            # HiGHS presolve doesn't check the time limit and runs for many seconds on big catalogs,
+            # without it the limit holds and solves under a few thousand rows are no slower
+            options={"time_limit": MILP_TIME_LIMIT_SECONDS, "presolve": False},
+        )
+
+
+def milp_template(view: FilteredView) -> "MilpTemplate":
+    return view.derived("milp", lambda v: MilpTemplate(scored_view(v)))
+
+
+def milp_basket(
+    scored: ScoredColumns,
+    budget: float,
+    daily_calories: int,
+    max_per_product: int = 3,
+    macros: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+    template: Optional[MilpTemplate] = None,
+) -> dict:
+    if not HAS_SCIPY:
+        return {"success": False, "status": "unavailable", "detail": "milp solver needs scipy installed"}
+    if not len(scored.candidates):
+        return {"success": False, "status": "no_products", "detail": "No products available"}
+
+    template = template or MilpTemplate(scored)
+    solution = template.solve(budget, max_per_product, macros or {})
+    if solution.x is None:
+        # status 1 is the time limit running out before any basket was found, which isn't proof there is none
+        if solution.status == 1:
+            return {"success": False, "status": "timeout", "detail": "Macro solver ran out of time, try fewer targets or a narrower diet"}
+        return {"success": False, "status": "infeasible", "detail": "No basket meets these macro targets within the budget"}
+
+    counts = np.round(solution.x).astype(np.int64)
+    chosen = {int(template.rows[i]): int(counts[i]) for i in np.flatnonzero(counts)}
+    result = _build_result(scored, _ranked_quantities(scored, chosen), budget, daily_calories)
+    result["proven_optimal"] = solution.status == 0
+    result["summary"]["macros"] = {
+        name: round(float((template.totals[name] * counts).sum()), 1) for name in ("fat", "carbs", "fiber")
+    }
+    return result
+
+
+# =============================================================================
+# PARETO FRONTIER
+# =============================================================================
+# "what if I spend $10 more" for every budget at once. the knapsack dp already knows the best
+# basket at every capacity, so we build it for max protein, max calories and a blend of both,
+# read baskets back at budgets where the best value steps up, and keep the ones nothing else beats on
+# cost (lower), protein (higher) and calories (higher).
+
+# True where no other point is at least as good everywhere and strictly better somewhere.
+# columns are already "lower is better"
+def pareto_mask(points: np.ndarray) -> np.ndarray:
+    if not len(points):
+        return np.zeros(0, dtype=bool)
+    no_worse = (points[:, None, :] <= points[None, :, :]).all(axis=2)
+    better = (points[:, None, :] < points[None, :, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=0)
+    return ~dominated
+
+
+def pareto_frontier(
+    scored: ScoredColumns,
+    max_budget: float,
+    max_per_product: int = 3,
+    samples: int = FRONTIER_SAMPLES,
+    resolution_cents: Optional[int] = None,
+) -> List[dict]:
+    protein = scored.total_protein
+    calories = scored.total_calories
+    # scale calories into protein units so the blend weighs both about equally
+    scale = float(protein[scored.candidates].sum() / max(calories[scored.candidates].sum(), 1.0)) if len(scored.candidates) else 1.0
+    objectives = [protein, calories, protein + calories * scale]
+
+    baskets: Dict[tuple, Dict[int, int]] = {}
+    for values in objectives:
+        table = KnapsackTable(scored, max_budget, max_per_product, values=values, resolution_cents=resolution_cents)
+        # only capacities where the best value actually improves hold a new basket
+        cells = np.flatnonzero(np.diff(table.dp) > 0) + 1
+        if len(cells) > samples:
+            cells = cells[np.unique(np.linspace(0, len(cells) - 1, num=samples).astype(np.int64))]
+        for cell in cells.tolist():
+            chosen = table.quantities_at(cell)
+            if chosen:
+                baskets.setdefault(tuple(sorted(chosen.items())), chosen)
+
+    candidates = list(baskets.values())
+    totals = np.array(
+        [
+            [
+                sum(float(scored.columns.price[row]) * qty for row, qty in chosen.items()),
+                sum(float(protein[row]) * qty for row, qty in chosen.items()),
+                sum(float(calories[row]) * qty for row, qty in chosen.items()),
+            ]
+            for chosen in candidates
+        ]
+    ).reshape(-1, 3)
+
+    keep = pareto_mask(totals * np.array([1.0, -1.0, -1.0]))
+    frontier = []
+    for i in np.flatnonzero(keep)[np.argsort(totals[keep, 0], kind="stable")].tolist():
+        cost, total_protein, total_calories = totals[i].tolist()
+        frontier.append({
+            "total_cost": round(cost, 2),
+            "total_protein": round(total_protein, 1),
+            "total_calories": round(total_calories, 0),
+            "items": _basket_items(scored, _ranked_quantities(scored, candidates[i])),
+        })
+    return frontier
+
+
+# =============================================================================
+# ENTRY POINTS
+# =============================================================================
+
+def solve(
+    scored: ScoredColumns,
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int = 3,
+    solver: str = "greedy",
+    resolution_cents: Optional[int] = None,
+    macros: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+    template: Optional[MilpTemplate] = None,
+) -> dict:
+    if solver == "milp":
+        result = milp_basket(scored, budget, daily_calories, max_per_product, macros, template)
+    elif solver == "knapsack":
+        result = knapsack_basket(scored, budget, daily_calories, daily_protein, max_per_product, resolution_cents)
+    else:
+        result = greedy_basket(scored, budget, daily_calories, daily_protein, max_per_product)
+    result["solver"] = solver
+    return result
+
+
+# the route passes a memoized view, anything else can still hand over a plain list of dicts
+def optimize_view(
+    view: FilteredView,
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int = 3,
+    solver: str = "greedy",
+    resolution_cents: Optional[int] = None,
+    macros: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+) -> dict:
+    with span("scoring"):
+        scored = scored_view(view)
+        template = milp_template(view) if solver == "milp" else None
+    with span("solve"):
+        return solve(
+            scored, budget, daily_calories, daily_protein, max_per_product,
+            solver, resolution_cents, macros, template,
+        )
+
+
+def optimize_basket(
+    products: List[dict],
+    budget: float,
+    daily_calories: int,
+    daily_protein: int,
+    max_per_product: int = 3,
+    solver: str = "greedy",
+    resolution_cents: Optional[int] = None,
+    macros: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+) -> dict:
+    scored = ScoredColumns(ProductColumns(products))
+    return solve(scored, budget, daily_calories, daily_protein, max_per_product, solver, resolution_cents, macros)
+
+
+# =============================================================================
+# BATCH
+# =============================================================================
+# a batch is already grouped by filter profile by the caller, so each group shares one
+# scored view. jobs are (scored, [solve kwargs, ...]) and come back in the same order.
+
+def solve_many(scored: ScoredColumns, params: List[Dict[str, Any]]) -> List[dict]:
+    # one milp model per filter group, every request in it only changes the bounds
+    template = None
+    if HAS_SCIPY and any(p.get("solver") == "milp" for p in params):
+        template = MilpTemplate(scored)
+    return [solve(scored, **p, template=template) for p in params]
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=BATCH_POOL_WORKERS)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def solve_batch(jobs: List[tuple]) -> List[List[dict]]:
+    total = sum(len(params) for _, params in jobs)
+    if total <= BATCH_POOL_THRESHOLD or BATCH_POOL_WORKERS <= 1:
+        return [solve_many(scored, params) for scored, params in jobs]
+
+    # each chunk ships its group's scored columns to a worker once, then solves the chunk there
+    pool = _process_pool()
+    futures = []
+    for scored, params in jobs:
+        chunks = [params[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(params), BATCH_CHUNK_SIZE)]
+        futures.append([pool.submit(solve_many, scored, chunk) for chunk in chunks])
+
+    return [[result for future in group for result in future.result()] for group in futures]
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+from lru import LRUCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scrapers"))
+
+# the supabase recipe_cache table from scrapers/recipe_cache.py is the second tier, if it imports
+# and a client can actually be made (the package being installed doesn't mean credentials exist)
+try:
+    import recipe_cache
+except ImportError as e:
+    print(f" Recipe cache table disabled: {e}")
+    recipe_cache = None
+
+
+def _table_available() -> bool:
+    if recipe_cache is None or not recipe_cache.HAS_SUPABASE:
+        return False
+    try:
+        recipe_cache.get_client()
+        return True
+    except Exception as e:
+        print(f" Recipe cache table disabled: {e}")
+        return False
+
+
+HAS_RECIPE_TABLE = _table_available()
+
+RECIPE_MEMORY_CACHE_SIZE = int(os.getenv("RECIPE_MEMORY_CACHE_SIZE", "1024"))
+
+# =============================================================================
+# TWO TIER RECIPE CACHE
+# =============================================================================
+# every spoonacular call costs api points, so the recipe routes go memory -> supabase table -> spoonacular.
+# keys are the same ones recipe_cache.py writes, so the scrapers and the api share one table.
+# identical misses that arrive together wait on the first one instead of each calling upstream.
+
+Fetch = Callable[[], Awaitable[List[Dict[str, Any]]]]
+
+
+def make_cache_key(cache_type: str, params: Dict[str, Any]) -> str:
+    if recipe_cache is not None:
+        return recipe_cache.make_cache_key(cache_type, params)
+    sorted_params = json.dumps(params, sort_keys=True)
+    return hashlib.md5(f"{cache_type}:{sorted_params}".encode()).hexdigest()
+
+
+class RecipeCache:
+    def __init__(self, maxsize: int = RECIPE_MEMORY_CACHE_SIZE):
+        self.memory = LRUCache(maxsize, name="recipes")
+        self.table_hits = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._writes: Set[asyncio.Task] = set()
+
+    async def get_or_fetch(self, cache_type: str, params: Dict[str, Any], fetch: Fetch) -> List[Dict[str, Any]]:
+        key = make_cache_key(cache_type, params)
+
+        recipes = self.memory.get(key)
+        if recipes is not None:
+            return recipes
+
+        inflight = self._inflight.get(key)
+        while inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # the request doing the fetch was cancelled (client went away), not us. take over
+                if not inflight.cancelled():
+                    raise
+            inflight = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            recipes = await self._load(key, cache_type, fetch)
+            future.set_result(recipes)
+            return recipes
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark it retrieved so nobody waiting is not a warning
+            raise
+        finally:
+            del self._inflight[key]
+            # cancelled mid fetch: wake the waiters so one of them retries instead of hanging
+            if not future.done():
+                future.cancel()
+
+    async def _load(self, key: str, cache_type: str, fetch: Fetch) -> List[Dict[str, Any]]:
+        if HAS_RECIPE_TABLE:
+            recipes = await asyncio.to_thread(recipe_cache.get_cached, key)
+            if recipes is not None:
+                self.table_hits += 1
+                self.memory.set(key, recipes)
+                return recipes
+
+        self.upstream_calls += 1
+        recipes = await fetch()
+        self.memory.set(key, recipes)
+
+        # write through to the table in the background, the response doesn't wait on it
+        if HAS_RECIPE_TABLE:
+            task = asyncio.create_task(asyncio.to_thread(recipe_cache.set_cached, key, cache_type, recipes))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+        return recipes
+
+    # the table tier on its own: a hit is a memory miss the table answered, a miss went upstream
+    def table_stats(self) -> Dict[str, Any]:
+        lookups = self.table_hits + self.upstream_calls
+        return {
+            "size": 0,
+            "hits": self.table_hits,
+            "misses": self.upstream_calls,
+            "hit_ratio": round(self.table_hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "table": "enabled" if HAS_RECIPE_TABLE else "disabled",
+            "table_hits": self.table_hits,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+        }
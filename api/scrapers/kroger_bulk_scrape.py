@@ -2,7 +2,6 @@ import os
 import sys
 import time
 import argparse
-from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))) # colorful sys path
@@ -30,7 +29,7 @@ except ImportError as e:
     HAS_KROGER = False
 
 try:
-    from supabase_client import get_client
+    from supabase_client import bulk_upsert_products, get_store_resolver
     HAS_SUPABASE = True
 except ImportError:
     print(" Supabase not configured - dry run only")
@@ -120,27 +119,15 @@ def get_or_create_store(location_id: str, name: str, chain: str, zip_code: str)
     if not HAS_SUPABASE:
         return None
     
-    client = get_client()
-    result = client.table("stores").select("id").eq("external_id", location_id).execute()
-    
-    if result.data:
-        return result.data[0]["id"]
-    
     store_data = {
         "name": name,
         "chain": chain.lower(),
-        "external_id": location_id,
         "zip_code": zip_code,
         "address": f"{name}, {zip_code}",
     }
     
-    result = client.table("stores").insert(store_data).execute()
-    
-    if result.data:
-        print(f"   Created store: {name} (ID: {result.data[0]['id']})")
-        return result.data[0]["id"]
-    
-    return None
+    # cached location_id -> uuid, only asks supabase the first time it sees a store
+    return get_store_resolver("external_id").resolve(location_id, store_data)
 
 
 def upload_products(products: List[CuentaProduct], store_id: str, dry_run: bool = False) -> Dict[str, int]:
@@ -150,45 +137,33 @@ def upload_products(products: List[CuentaProduct], store_id: str, dry_run: bool
         stats["skipped"] = len(products)
         return stats
     
-    client = get_client()
-    
+    rows = []
     for product in products:
-        try:
-            total_protein = product.protein * product.servings
-            protein_per_dollar = total_protein / product.price if product.price > 0 else 0
-            protein_per_100cal = (product.protein / product.calories * 100) if product.calories > 0 else 0
-            
-            product_data = {
-                "store_id": store_id,
-                "name": product.name[:255],
-                "price": product.price,
-                "calories": product.calories,
-                "protein": product.protein,
-                "fat": getattr(product, 'fat', 0),
-                "carbs": getattr(product, 'carbs', 0),
-                "fiber": getattr(product, 'fiber', 0),
-                "serving_size": product.serving_size,
-                "servings_per_container": product.servings,
-                "category": product.category,
-                "tags": list(product.tags),
-                "barcode": product.upc,
-                "external_id": product.product_id,
-                "image_url": product.image_url,
-                "brand": product.brand,
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-            }
-            
-            # Upsert by store_id + external_id
-            client.table("products").upsert(
-                product_data,
-                on_conflict="store_id,external_id"
-            ).execute()
-            
-            stats["uploaded"] += 1
-            
-        except Exception as e:
-            print(f"   ❌ Error uploading {product.name[:30]}: {e}")
-            stats["errors"] += 1
+        rows.append({
+            "store_id": store_id,
+            "name": product.name[:255],
+            "price": product.price,
+            "calories": product.calories,
+            "protein": product.protein,
+            "fat": getattr(product, 'fat', 0),
+            "carbs": getattr(product, 'carbs', 0),
+            "fiber": getattr(product, 'fiber', 0),
+            "serving_size": product.serving_size,
+            "servings_per_container": product.servings,
+            "category": product.category,
+            "tags": list(product.tags),
+            "barcode": product.upc,
+            "external_id": product.product_id,
+            "image_url": product.image_url,
+            "brand": product.brand,
+        })
+    
+    # Upsert by store_id + external_id, one request per chunk instead of per product
+    result = bulk_upsert_products(rows, on_conflict="store_id,external_id")
+    stats["uploaded"] = result["inserted"] + result["updated"]
+    stats["inserted"] = result["inserted"]
+    stats["updated"] = result["updated"]
+    stats["errors"] = result["failed"]
     
     return stats
 
@@ -76,6 +76,19 @@ def _set_cached(cache_key: str, cache_type: str, recipes: List[Dict[str, Any]],
         print(f"Cache write error: {e}")
 
 
+# same helpers for the api, which puts its own in-memory tier in front of this table (api/recipes.py)
+def make_cache_key(cache_type: str, params: Dict[str, Any]) -> str:
+    return _make_cache_key(cache_type, params)
+
+
+def get_cached(cache_key: str) -> Optional[List[Dict[str, Any]]]:
+    return _get_cached(cache_key)
+
+
+def set_cached(cache_key: str, cache_type: str, recipes: List[Dict[str, Any]], ttl_days: int = 7) -> None:
+    _set_cached(cache_key, cache_type, recipes, ttl_days)
+
+
 # =============================================================================
 # SPOONACULAR API (with caching)
 # =============================================================================
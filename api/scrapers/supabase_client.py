@@ -1,13 +1,27 @@
 import os
-from typing import Optional, List
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, List, Sequence
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 
 load_dotenv()
 # one of the most useful features i've learned while developing- the power of .env 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")  # Use service key for backend operations
 
+UPSERT_CHUNK_SIZE = int(os.getenv("UPSERT_CHUNK_SIZE", "500"))
+UPSERT_MAX_IN_FLIGHT = int(os.getenv("UPSERT_MAX_IN_FLIGHT", "4"))
+UPSERT_RETRIES = int(os.getenv("UPSERT_RETRIES", "3"))
+UPSERT_BACKOFF_SECONDS = float(os.getenv("UPSERT_BACKOFF_SECONDS", "0.5"))
+STORE_CACHE_FILE = os.getenv(
+    "STORE_CACHE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".store_cache.json")
+)
+
 _client: Optional[Client] = None
 
 def get_client() -> Client:
@@ -19,25 +33,116 @@ def get_client() -> Client:
     return _client
 
 
+# =============================================================================
+# STORE RESOLVER
+# =============================================================================
+# external store id (target store_id, kroger location_id, ...) -> stores.id uuid. answers come from
+# memory, then a json file next to this module so the next scrape run starts warm, then one in_()
+# select for everything still unknown, and whatever isn't in the table yet is created with one
+# bulk insert. key_column is which stores column holds the external id: store_id for the seed.sql
+# and aldi/target-json rows, external_id for what the kroger/target bulk scrapers create.
+# if a store gets deleted from supabase, delete the cache file (or call clear()).
+
+class StoreResolver:
+    def __init__(self, key_column: str = "store_id", cache_file: Optional[str] = STORE_CACHE_FILE, client: Any = None):
+        self.key_column = key_column
+        self.cache_file = cache_file
+        self._client = client
+        self._ids: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    def _cache_key(self, external_id: str) -> str:
+        return f"{self.key_column}:{external_id}"
+
+    def _load(self) -> None:
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f" Store cache unreadable, ignoring it: {e}")
+            return
+        prefix = f"{self.key_column}:"
+        self._ids = {k[len(prefix):]: v for k, v in cached.items() if k.startswith(prefix)}
+
+    # merge into whatever is on disk (other key columns, other runs), then swap the file in whole
+    def _save(self) -> None:
+        if not self.cache_file:
+            return
+        try:
+            cached = {}
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file) as f:
+                    cached = json.load(f)
+            cached.update({self._cache_key(k): v for k, v in self._ids.items()})
+            tmp = f"{self.cache_file}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(cached, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.cache_file)
+        except (OSError, ValueError) as e:
+            print(f" Could not write store cache: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids = {}
+            if self.cache_file and os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+
+    # stores is external id -> the row to insert if it doesn't exist yet (key column gets filled in)
+    def resolve_many(self, stores: Dict[str, dict]) -> Dict[str, str]:
+        with self._lock:
+            resolved = {k: self._ids[k] for k in stores if k in self._ids}
+            missing = [k for k in stores if k not in resolved]
+            if not missing:
+                return resolved
+
+            found = self.client.table("stores").select(f"id,{self.key_column}").in_(self.key_column, missing).execute()
+            for row in found.data or []:
+                resolved[str(row[self.key_column])] = row["id"]
+
+            new_rows = [{**stores[k], self.key_column: k} for k in missing if k not in resolved]
+            if new_rows:
+                created = self.client.table("stores").insert(new_rows).execute()
+                for row in created.data or []:
+                    resolved[str(row[self.key_column])] = row["id"]
+                    print(f"   Created store: {row.get('name')} (ID: {row['id']})")
+
+            self._ids.update({k: v for k, v in resolved.items() if k in missing})
+            self._save()
+            return resolved
+
+    def resolve(self, external_id: str, store: Optional[dict] = None) -> Optional[str]:
+        return self.resolve_many({external_id: store or {}}).get(external_id)
+
+
+_resolvers: Dict[str, StoreResolver] = {}
+
+
+def get_store_resolver(key_column: str = "store_id", client: Any = None) -> StoreResolver:
+    resolver = _resolvers.get(key_column)
+    if resolver is None:
+        resolver = _resolvers[key_column] = StoreResolver(key_column, client=client)
+    return resolver
+
+
 def get_or_create_store(name: str, store_id: str, zip_code: str = None, city: str = None, state: str = None) -> dict:
     # get or create the store, getting or creating all the information needed ^
-    client = get_client()
-    # a helpful way to check if it actually exists
-    result = client.table("stores").select("*").eq("store_id", store_id).execute()
-    # if result dat, return
-    if result.data:
-        return result.data[0]
-    
-    # If new 
     new_store = {
         "name": name,
-        "store_id": store_id,
         "zip_code": zip_code,
         "city": city,
         "state": state,
     }
-    result = client.table("stores").insert(new_store).execute()
-    return result.data[0]
+    store_db_id = get_store_resolver("store_id").resolve(store_id, new_store)
+    return {"id": store_db_id, "store_id": store_id, **new_store}
 
 # get stores by zip is just as listed, this function grabs the client and the return is a table of all stores near a zipcode
 def get_stores_by_zip(zip_code: str) -> List[dict]:
@@ -48,41 +153,207 @@ def get_stores_by_zip(zip_code: str) -> List[dict]:
 # ==========================================
 # Products 
 # ==========================================
-# "upsert" a product, essentially using an external id for mtching and if we have it, check if the product even exists, which then should update the existing. 
+# computed by postgres (GENERATED ALWAYS / the last_updated trigger), sending them makes the write fail or lie
+SERVER_COLUMNS = ("protein_per_dollar", "protein_per_100cal", "last_updated", "created_at")
+
+
+def _clean_row(product: dict, store_id: Optional[str]) -> dict:
+    row = {k: v for k, v in product.items() if k not in SERVER_COLUMNS}
+    if store_id:
+        row["store_id"] = store_id
+    return row
+
+
+# =============================================================================
+# BULK WRITER
+# =============================================================================
+# chunks go out on a small thread pool so at most max_in_flight requests are open at once.
+# every failure is retried (exponential backoff + jitter). if it's still failing and the error
+# is about the data (a 4xx from postgrest: bad value, constraint, unknown column) the chunk is
+# split in half and the halves get one try each, down to single rows, so one bad row only fails
+# itself instead of taking 499 good ones with it. anything else (timeouts, 5xx, connection
+# drops) fails the whole chunk, splitting would just multiply requests against a sick server.
+
+# sqlstate classes postgrest answers with a 4xx: 22 data exception, 23 constraint, 42 bad column/syntax.
+# PGRST1xx/2xx are its own request and schema errors (PGRST0xx is "can't reach the db", a 503)
+DATA_ERROR_SQLSTATES = ("22", "23", "42")
+DATA_ERROR_PGRST = ("PGRST1", "PGRST2")
+
+
+def is_data_error(error: Exception) -> bool:
+    if not isinstance(error, APIError):
+        return False
+    code = str(error.code or "")
+    if code.isdigit() and len(code) == 3:
+        # no json body, postgrest-py puts the http status in code
+        return 400 <= int(code) < 500 and int(code) not in (408, 429)
+    if code.startswith("PGRST"):
+        return code.startswith(DATA_ERROR_PGRST)
+    return len(code) == 5 and code[:2] in DATA_ERROR_SQLSTATES
+
+class BulkWriter:
+    def __init__(
+        self,
+        table: str = "products",
+        on_conflict: str = "external_id",
+        chunk_size: int = UPSERT_CHUNK_SIZE,
+        max_in_flight: int = UPSERT_MAX_IN_FLIGHT,
+        retries: int = UPSERT_RETRIES,
+        backoff: float = UPSERT_BACKOFF_SECONDS,
+        client: Any = None,
+    ):
+        self.table = table
+        self.on_conflict = on_conflict
+        self.chunk_size = max(1, chunk_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.retries = retries
+        self.backoff = backoff
+        self.client = client or get_client()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {}
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+
+    def _send(self, rows: List[dict]) -> List[dict]:
+        self._count("requests")
+        result = self.client.table(self.table).upsert(rows, on_conflict=self.on_conflict).execute()
+        return result.data or []
+
+    def _write_chunk(self, rows: List[dict], attempts: int) -> None:
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                self._count("retries")
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+            try:
+                saved = self._send(rows)
+                break
+            except Exception as e:
+                error = e
+        else:
+            if len(rows) == 1 or not is_data_error(error):
+                self._count("failed", len(rows))
+                label = rows[0].get("external_id") or rows[0].get("name")
+                if len(rows) > 1:
+                    label = f"chunk of {len(rows)} from {label}"
+                with self._lock:
+                    if len(self._stats["errors"]) < 20:
+                        self._stats["errors"].append(f"{label}: {error}")
+                return
+            self._count("splits")
+            middle = len(rows) // 2
+            self._write_chunk(rows[:middle], 1)
+            self._write_chunk(rows[middle:], 1)
+            return
+
+        # a new row has created_at == last_updated (both now() in one transaction), the trigger bumps updates
+        inserted = sum(1 for row in saved if row.get("created_at") == row.get("last_updated"))
+        self._count("inserted", inserted)
+        self._count("updated", len(saved) - inserted)
+
+    def write(self, rows: List[dict]) -> Dict[str, Any]:
+        self._stats = {
+            "inserted": 0, "updated": 0, "failed": 0,
+            "requests": 0, "retries": 0, "splits": 0, "errors": [],
+        }
+        start = time.perf_counter()
+
+        # postgrest wants every object in one request to have the same keys
+        by_columns: Dict[frozenset, List[dict]] = {}
+        for row in rows:
+            by_columns.setdefault(frozenset(row), []).append(row)
+        chunks = [
+            group[i:i + self.chunk_size]
+            for group in by_columns.values()
+            for i in range(0, len(group), self.chunk_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            for future in [pool.submit(self._write_chunk, chunk, self.retries + 1) for chunk in chunks]:
+                future.result()
+
+        elapsed = time.perf_counter() - start
+        stats = dict(self._stats)
+        stats["seconds"] = round(elapsed, 3)
+        stats["rows_per_s"] = round(len(rows) / elapsed, 1) if elapsed > 0 else 0.0
+        return stats
+
+
+# bulk upsert: any number of products, postgres sorts out insert vs update with ON CONFLICT.
+# returns the writer's counts (inserted / updated / failed, rows_per_s, ...) plus duplicates
+def bulk_upsert_products(
+    products: List[dict],
+    store_id: str = None,
+    on_conflict: str = "external_id",
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+    client: Any = None,
+    max_in_flight: int = UPSERT_MAX_IN_FLIGHT,
+) -> Dict[str, Any]:
+    duplicates = 0
+
+    # the same conflict key twice in one statement is an error in postgres, last one wins
+    conflict_columns = [c.strip() for c in on_conflict.split(",")]
+    unique: Dict[Any, dict] = {}
+    for i, product in enumerate(products):
+        row = _clean_row(product, store_id)
+        key = tuple(row.get(c) for c in conflict_columns)
+        if None in key:
+            key = ("row", i)  # no key means nothing to conflict with, always its own insert
+        if key in unique:
+            duplicates += 1
+        unique[key] = row
+
+    writer = BulkWriter(
+        on_conflict=on_conflict,
+        chunk_size=chunk_size,
+        max_in_flight=max_in_flight,
+        client=client,
+    )
+    stats = writer.write(list(unique.values()))
+    stats["duplicates"] = duplicates
+    return stats
+
+
+# single product, one round trip now (used to be a select and then an update or insert).
+# without an external_id there's nothing to match on and it's always a new row, same as before
 def upsert_product(product: dict, store_id: str = None) -> dict:
     client = get_client()
-    
-    # If we have an external_id, check if product exists
-    if product.get("external_id"):
-        existing = client.table("products").select("id").eq("external_id", product["external_id"]).execute()
-        if existing.data:
-            # This is the real carry, updating the existing 
-            result = client.table("products").update(product).eq("external_id", product["external_id"]).execute()
-            return result.data[0] if result.data else None
-    
-    # This inserts new, and it's why it's outside of the if statement
-    if store_id:
-        product["store_id"] = store_id
-    
-    result = client.table("products").insert(product).execute()
+    row = _clean_row(product, store_id)
+    if row.get("external_id"):
+        result = client.table("products").upsert(row, on_conflict="external_id").execute()
+    else:
+        result = client.table("products").insert(row).execute()
     return result.data[0] if result.data else None
 
 # batch the products, and return the count of the result data aka how many successful inserts
 def upsert_products_batch(products: List[dict], store_id: str = None) -> int:
-    client = get_client()
-    
-    # Add store_id to all products
-    if store_id:
-        for p in products:
-            p["store_id"] = store_id
-    
-    # Supabase upsert with external_id as the conflict key
-    result = client.table("products").upsert(
-        products, 
-        on_conflict="external_id"
-    ).execute()
-    
-    return len(result.data) if result.data else 0
+    stats = bulk_upsert_products(products, store_id=store_id)
+    return stats["inserted"] + stats["updated"]
+
+
+# what the optimizer actually reads off a product row. images, barcodes and timestamps stay on the server
+OPTIMIZER_COLUMNS = (
+    "id", "external_id", "name", "store_id", "price",
+    "calories", "protein", "carbs", "fat", "fiber", "servings_per_container",
+    "protein_per_dollar", "category", "tags",
+)
+# the optimizer set plus what a product listing shows
+LISTING_COLUMNS = OPTIMIZER_COLUMNS + ("brand", "unit_price", "serving_size", "image_url")
+
+
+# postgrest array literal, quoted so tags with commas or spaces don't break the filter
+def _pg_array(values: Sequence[str]) -> str:
+    quoted = ('"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+    return "{" + ",".join(quoted) + "}"
+
+
+# drop rows whose tags overlap exclude_tags on the server. not.ov alone also drops untagged rows
+# (NULL overlaps nothing, so the comparison is NULL), hence the is.null branch
+def exclude_tags_filter(query: Any, exclude_tags: Optional[Sequence[str]]) -> Any:
+    if not exclude_tags:
+        return query
+    return query.or_(f"tags.is.null,tags.not.ov.{_pg_array(exclude_tags)}")
 
 
 def get_products(
@@ -91,12 +362,14 @@ def get_products(
     min_protein_per_dollar: float = None,
     limit: int = 100,
     order_by: str = "protein_per_dollar",
-    ascending: bool = False
+    ascending: bool = False,
+    exclude_tags: List[str] = None,
+    columns: Sequence[str] = LISTING_COLUMNS,
 ) -> List[dict]:
 # Query products with filters 
     client = get_client()
     
-    query = client.table("products").select("*")
+    query = client.table("products").select(",".join(columns))
     
     if category:
         query = query.eq("category", category)
@@ -104,6 +377,7 @@ def get_products(
         query = query.eq("store_id", store_id)
     if min_protein_per_dollar:
         query = query.gte("protein_per_dollar", min_protein_per_dollar)
+    query = exclude_tags_filter(query, exclude_tags)
     
     query = query.order(order_by, desc=not ascending).limit(limit)
     
@@ -111,25 +385,22 @@ def get_products(
     return result.data
 
 # function is self explanatory but bini isn't the brightest, this grabs those products that have passed the tests aka have nutrition data
-def get_products_for_optimization(store_id: str = None, exclude_tags: List[str] = None) -> List[dict]:
+# tag exclusion happens in postgres now, only rows the optimizer can use come back
+def get_products_for_optimization(
+    store_id: str = None,
+    exclude_tags: List[str] = None,
+    columns: Sequence[str] = OPTIMIZER_COLUMNS,
+) -> List[dict]:
     client = get_client()
     
-    query = client.table("products").select("*").gt("protein", 0)
+    query = client.table("products").select(",".join(columns)).gt("protein", 0).gt("price", 0)
     
     if store_id:
         query = query.eq("store_id", store_id)
+    query = exclude_tags_filter(query, exclude_tags)
     
     result = query.execute()
-    products = result.data
-    
-# Filter by tags in Python (Supabase array contains is weird as heck)
-    if exclude_tags:
-        products = [
-            p for p in products 
-            if not any(tag in (p.get("tags") or []) for tag in exclude_tags)
-        ]
-    
-    return products
+    return result.data
 
 
 # =============================================================================
@@ -175,7 +446,9 @@ def save_target_products_batch(products, store_db_id: str = None) -> int:
             "tags": list(p.tags),
         })
     
-    return upsert_products_batch(product_dicts, store_id=store_db_id)
+    stats = bulk_upsert_products(product_dicts, store_id=store_db_id)
+    print(f" Saved {stats['inserted']} new, {stats['updated']} updated, {stats['failed']} failed ({stats['rows_per_s']} rows/s)")
+    return stats["inserted"] + stats["updated"]
 
 
 # =============================================================================
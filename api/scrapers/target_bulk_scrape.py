@@ -4,7 +4,6 @@ import warnings
 import re
 import uuid
 import random
-from datetime import datetime, timezone
 from typing import Optional, List, Dict, Set, Any
 from dataclasses import dataclass
 
@@ -20,6 +19,7 @@ try:
     from dotenv import load_dotenv
     import os
     load_dotenv()
+    from supabase_client import bulk_upsert_products, get_store_resolver
     HAS_SUPABASE = True
 except ImportError:
     HAS_SUPABASE = False
@@ -479,25 +479,13 @@ def get_or_create_store(location_id: str, name: str, chain: str, zip_code: str)
     if not HAS_SUPABASE:
         return None
     
-    client = get_client()
-    
-    result = client.table("stores").select("id").eq("external_id", location_id).execute()
-    
-    if result.data:
-        return result.data[0]["id"]
-    
     new_store = {
         "name": name,
-        "external_id": location_id,
         "chain": chain,
         "zip_code": zip_code,
     }
     
-    result = client.table("stores").insert(new_store).execute()
-    if result.data:
-        return result.data[0]["id"]
-    
-    return None
+    return get_store_resolver("external_id", client=get_client()).resolve(location_id, new_store)
 
 def upload_products(products: List[CuentaProduct], store_id: str, dry_run: bool = False) -> Dict[str, int]:
     stats = {"uploaded": 0, "skipped": 0, "errors": 0}
@@ -506,48 +494,33 @@ def upload_products(products: List[CuentaProduct], store_id: str, dry_run: bool
         stats["skipped"] = len(products)
         return stats
     
-    client = get_client()
-    
+    # protein_per_dollar / protein_per_100cal are generated columns, postgres computes them
+    rows = []
     for product in products:
-        try:
-            # Calculate derived fields
-            total_protein = product.protein * product.servings
-            protein_per_dollar = total_protein / product.price if product.price > 0 else 0
-            total_calories = product.calories * product.servings
-            protein_per_100cal = (product.protein / product.calories * 100) if product.calories > 0 else 0
-            
-            product_data = {
-                "store_id": store_id,
-                "name": product.name[:255],
-                "price": product.price,
-                "calories": product.calories,
-                "protein": product.protein,
-                "fat": product.fat,
-                "carbs": product.carbs,
-                "fiber": product.fiber,
-                "serving_size": product.serving_size,
-                "servings_per_container": product.servings,
-                "protein_per_dollar": protein_per_dollar,
-                "protein_per_100cal": protein_per_100cal,
-                "category": product.category,
-                "tags": list(product.tags),
-                "barcode": product.barcode,
-                "external_id": product.tcin,
-                "image_url": product.image_url,
-                "brand": product.brand,
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-            }
-            
-            client.table("products").upsert(
-                product_data,
-                on_conflict="store_id,external_id"
-            ).execute()
-            
-            stats["uploaded"] += 1
-            
-        except Exception as e:
-            print(f"   Error uploading {product.name[:30]}: {e}")
-            stats["errors"] += 1
+        rows.append({
+            "store_id": store_id,
+            "name": product.name[:255],
+            "price": product.price,
+            "calories": product.calories,
+            "protein": product.protein,
+            "fat": product.fat,
+            "carbs": product.carbs,
+            "fiber": product.fiber,
+            "serving_size": product.serving_size,
+            "servings_per_container": product.servings,
+            "category": product.category,
+            "tags": list(product.tags),
+            "barcode": product.barcode,
+            "external_id": product.tcin,
+            "image_url": product.image_url,
+            "brand": product.brand,
+        })
+    
+    result = bulk_upsert_products(rows, on_conflict="store_id,external_id", client=get_client())
+    stats["uploaded"] = result["inserted"] + result["updated"]
+    stats["inserted"] = result["inserted"]
+    stats["updated"] = result["updated"]
+    stats["errors"] = result["failed"]
     
     return stats
 